@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the server running on a DME660. It speaks the same line
+based protocol and serves frames from a recording of live_viewer.py or
+synthetic frames, with a configurable frame rate and injected latency.
+
+Usage:
+    python CameraEmulator.py [--recording data.h5] [--fps 30]
+                             [--latency 5] [--port 50660]
+    python CameraEmulator.py --benchmark
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from epc_lib import epc_math
+
+
+# registers holding the IC type, read by imager.imagerInit
+IC_TYPE_REGISTER = 0x12
+IC_TYPES = {(320, 240): 2, (160, 60): 4}
+
+# commands that just change a setting and answer with a status, setROI
+# also crops the served frames
+SETTING_COMMANDS = ('setIntegrationTime2D', 'setIntegrationTime3D',
+                    'setModulationFrequency', 'enableSaturation',
+                    'enableAdcOverflow', 'correctTemperature',
+                    'correctAmbientLight', 'correctDRNU', 'loadConfig',
+                    'startVideo', 'stopVideo', 'setROI')
+
+
+def synthetic_dcs(width=160, height=60, n_frames=100, mod_freq=20):
+    """
+    Create DCS images of a floor with a person walking through the image.
+
+    Parameters
+    ----------
+    width : int, optional
+        Number of columns. The default is 160.
+    height : int, optional
+        Number of rows. The default is 60.
+    n_frames : int, optional
+        Number of frames. The default is 100.
+    mod_freq : int, optional
+        The LED modulation frequency in MHz. The default is 20.
+
+    Returns
+    -------
+    dcs : numpy array, shape (width, height, 4, n_frames)
+        The DCS images, in the layout of a live_viewer.py recording.
+
+    """
+    d_unamb = 3e8 / (mod_freq * 1e6) / 2 * 1000  # mm
+    x, y = np.meshgrid(np.arange(width), np.arange(height), indexing='ij')
+
+    dcs = np.empty((width, height, 4, n_frames), dtype=np.uint16)
+    for n in range(n_frames):
+        # floor at 2.5 m, a person of 1.7 m walks along the columns
+        dist = np.full((width, height), 2500.0)
+        cx = (n / n_frames) * (width + 40) - 20
+        person = ((x - cx) / 12)**2 + ((y - height / 2) / 10)**2 < 1
+        dist[person] = 800.0
+        ampl = np.where(person, 1200.0, 600.0)
+
+        # invert epc_math.calc_dist_phase and calc_amplitude
+        phase = 2 * np.pi * dist / d_unamb - np.pi
+        offset = 2048
+        dcs[:, :, 0, n] = offset - ampl * np.cos(phase)
+        dcs[:, :, 1, n] = offset - ampl * np.sin(phase)
+        dcs[:, :, 2, n] = offset + ampl * np.cos(phase)
+        dcs[:, :, 3, n] = offset + ampl * np.sin(phase)
+    return dcs
+
+
+def load_recording(path):
+    """
+    Load a recording written by live_viewer.py.
+
+    Parameters
+    ----------
+    path : str
+        Path of the HDF5 file.
+
+    Returns
+    -------
+    mode : str
+        'dcs' or 'distamp'.
+    data : numpy array, shape (width, height, frames, n_frames)
+        The recorded images.
+
+    """
+    import h5py
+
+    with h5py.File(path, 'r') as f:
+        mode = list(f.keys())[0]
+        data = f[mode][()].astype(np.uint16)
+    return mode, data
+
+
+class CameraEmulator:
+    """
+    The state of the emulated camera: frames, registers and timing.
+    """
+
+    def __init__(self, data, mode='dcs', fps=30.0, latency=0.0, mod_freq=20):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        data : numpy array, shape (width, height, frames, n_frames)
+            The images to serve.
+        mode : str, optional
+            'dcs' or 'distamp', the content of data. The default is 'dcs'.
+        fps : float, optional
+            Frame rate of the camera. The default is 30.0.
+        latency : float, optional
+            Additional delay of every answer in seconds. The default is 0.
+        mod_freq : int, optional
+            The LED modulation frequency in MHz used to calculate distance
+            and amplitude from DCS. The default is 20.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.width, self.height = data.shape[0], data.shape[1]
+        self.fps = fps
+        self.latency = latency
+        self.video = False
+        self.registers = np.zeros(0x100, dtype='<i2')
+        self.registers[IC_TYPE_REGISTER] = IC_TYPES.get(
+            (self.width, self.height), 0)
+        self.settings = {}
+        self._t0 = time.time()
+
+        # images of the full sensor by command, one entry per frame
+        n_frames = data.shape[3]
+        self._images = {}
+        if mode == 'dcs':
+            self._images['getDCSSorted'] = [data[..., n]
+                                            for n in range(n_frames)]
+            dist, ampl = [], []
+            for n in range(n_frames):
+                d, _ = epc_math.calc_dist_phase(data[..., n], mod_freq)
+                a = epc_math.calc_amplitude(data[..., n])
+                dist.append(d.T.clip(0, 65000).astype(np.uint16))
+                ampl.append(a.T.clip(0, 65000).astype(np.uint16))
+        else:
+            dist = [data[:, :, 0, n] for n in range(n_frames)]
+            ampl = [data[:, :, 1, n] for n in range(n_frames)]
+        self._images['getDistanceAndAmplitudeSorted'] = [
+            np.dstack((d, a)) for d, a in zip(dist, ampl)]
+        self._images['getDistanceSorted'] = [d[..., None] for d in dist]
+        self._images['getAmplitudeSorted'] = [a[..., None] for a in ampl]
+
+        # answers in the byte order of the server, cropped to the ROI
+        self.set_roi(0, 0, self.width - 1, self.height - 1)
+
+    def set_roi(self, left, top, right, bottom):
+        """
+        Serve only the columns left..right and the rows top..bottom of the
+        frames, like setROI of the server.
+
+        Parameters
+        ----------
+        left : int
+            First column.
+        top : int
+            First row.
+        right : int
+            Last column.
+        bottom : int
+            Last row.
+
+        Returns
+        -------
+        valid : bool
+            False if the rectangle is not on the sensor, then the ROI is
+            not changed.
+
+        """
+        if not (0 <= left <= right < self.width and
+                0 <= top <= bottom < self.height):
+            return False
+        self._frames = {
+            command: [self._to_bytes(image[left:right+1, top:bottom+1])
+                      for image in images]
+            for command, images in self._images.items()}
+        self.roi = (left, top, right, bottom)
+        return True
+
+    @staticmethod
+    def _to_bytes(image):
+        """
+        Convert an image of shape (width, height, frames) into the row by
+        row byte stream of the server.
+        """
+        return np.ascontiguousarray(
+            np.transpose(image, [2, 1, 0])).astype('<u2').tobytes()
+
+    def next_frame(self, last):
+        """
+        Wait for the next frame of the camera.
+
+        Parameters
+        ----------
+        last : int
+            Number of the last frame served on this connection.
+
+        Returns
+        -------
+        number : int
+            Number of the frame to serve.
+
+        """
+        if self.video:
+            # the camera runs freely, serve the newest frame not served yet
+            number = int((time.time() - self._t0) * self.fps)
+            if number <= last:
+                number = last + 1
+                time.sleep(max(0, self._t0 + number / self.fps - time.time()))
+        else:
+            # every request triggers one acquisition
+            time.sleep(1 / self.fps)
+            number = last + 1
+        return number
+
+    def answer(self, line, state):
+        """
+        Create the answer to one command line.
+
+        Parameters
+        ----------
+        line : str
+            The command without line ending.
+        state : dict
+            State of the connection.
+
+        Returns
+        -------
+        answer : bytes
+            The answer to send.
+
+        """
+        args = line.split()
+        if not args:
+            return b''
+        command = args[0]
+        status_ok = np.array([0], dtype='<i2').tobytes()
+
+        if command in self._frames:
+            state['frame'] = self.next_frame(state['frame'])
+            frames = self._frames[command]
+            return frames[state['frame'] % len(frames)]
+        elif command == 'getTemperature':
+            return np.array([25 * 16], dtype='<u2').tobytes()
+        elif command == 'dumpAllRegisters':
+            return self.registers.tobytes()
+        elif command == 'r':
+            address = int(args[1], 16)
+            count = int(args[2]) if len(args) > 2 else 1
+            return self.registers[address:address+count].tobytes()
+        elif command == 'w':
+            self.registers[int(args[1], 16)] = int(args[2], 16)
+            return status_ok
+        elif command == 'setROI':
+            if len(args) != 5 or not self.set_roi(*map(int, args[1:])):
+                return np.array([-1], dtype='<i2').tobytes()
+            self.settings[command] = args[1:]
+            return status_ok
+        elif command in SETTING_COMMANDS:
+            self.settings[command] = args[1:]
+            if command == 'startVideo':
+                self.video = True
+            elif command == 'stopVideo':
+                self.video = False
+            return status_ok
+        return np.array([-1], dtype='<i2').tobytes()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Serves the commands of one connection.
+    """
+
+    # pipelined commands get one small answer each, which must not wait
+    # for the delayed acknowledge of the previous one
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        emulator = self.server.emulator
+        state = {'frame': -1}
+        for line in self.rfile:
+            answer = emulator.answer(line.decode().strip(), state)
+            if emulator.latency:
+                time.sleep(emulator.latency)
+            self.wfile.write(answer)
+
+
+class EmulatorServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server that serves the emulated camera to any number of clients.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, emulator, host='127.0.0.1', port=50660):
+        super().__init__((host, port), _Handler)
+        self.emulator = emulator
+
+
+def benchmark(emulator, n_frames=200):
+    """
+    Measure the acquisition throughput against a local emulator.
+
+    Parameters
+    ----------
+    emulator : CameraEmulator
+        The emulated camera.
+    n_frames : int, optional
+        Number of frames per measurement. The default is 200.
+
+    Returns
+    -------
+    None.
+
+    """
+    from epc_lib import epc_server, epc_image
+    from imager import imager
+
+    server = EmulatorServer(emulator, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    epc = epc_server('127.0.0.1', server.server_address[1])
+    imgDev = epc_image(epc)
+    imager.imagerInit(epc, imgDev)
+
+    t = time.time()
+    for n in range(n_frames):
+        imgDev.getDCSs()
+    print('getDCSs: {:.1f} fps'.format(n_frames / (time.time() - t)))
+
+    stream = imgDev.streamDCSs()
+    t = time.time()
+    for n in range(n_frames):
+        next(stream)
+    print('streamDCSs: {:.1f} fps'.format(n_frames / (time.time() - t)))
+    stream.close()
+
+    print(epc.connection.timing.summary())
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--recording', help='HDF5 file of live_viewer.py')
+    parser.add_argument('--size', default='160x60',
+                        help='size of synthetic frames, e.g. 320x240')
+    parser.add_argument('--fps', type=float, default=30.0)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='additional delay of every answer in ms')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=50660)
+    parser.add_argument('--benchmark', action='store_true',
+                        help='measure the acquisition throughput and exit')
+    args = parser.parse_args()
+
+    if args.recording:
+        mode, data = load_recording(args.recording)
+    else:
+        width, height = [int(v) for v in args.size.split('x')]
+        mode, data = 'dcs', synthetic_dcs(width, height)
+    emulator = CameraEmulator(data, mode, args.fps, args.latency / 1000)
+
+    if args.benchmark:
+        benchmark(emulator)
+    else:
+        server = EmulatorServer(emulator, args.host, args.port)
+        print('Emulating camera on {}:{}'.format(args.host, args.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -8,7 +8,7 @@ Created on Thu Jan  2 14:30:11 2020
 import numpy as np
 from epc_lib import epc_math
 
-d_unamb = {20: 7500, 10: 15000, 5: 30000, 2.5: 60000, 1.25: 120000}
+d_unamb = epc_math.D_UNAMB
 
 dcs = np.random.randint(1, 20, (10, 10, 4))
 
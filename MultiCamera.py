@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Person counter for entrances with several cameras. Every camera gets its
+own acquisition thread and dispatcher, the image processing of all cameras
+runs in one shared pool of worker threads (NumPy and OpenCV release the
+GIL in their kernels). Every camera is connected in its own thread and
+its requests time out after server_timeout seconds, so a slow or dead
+camera only stalls itself.
+
+Usage: python MultiCamera.py config_cam1.ini config_cam2.ini ...
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from epc_lib import epc_server, epc_image, epc_acquisition
+from epc_lib import epc_config
+from imgProc.personDetector import PersonDetector, roi_from_config
+from imager import imager
+
+
+class Camera:
+    """
+    One camera with its acquisition, detection state and counters.
+    """
+
+    def __init__(self, config, pool):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        config : dict
+            The configuration of the camera.
+        pool : ThreadPoolExecutor
+            The shared processing pool.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.address = (config['server_ip'], config.get('server_port', 50660))
+        self.name = '{}:{}'.format(*self.address)
+        self._config = config
+        self._pool = pool
+        self._running = False
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._acquisition = None
+        self._detector = PersonDetector(config)
+
+        self.connected = False
+        self.entries = 0
+        self.exits = 0
+        self.frames_processed = 0
+        self._start_time = None
+
+    def connect(self):
+        """
+        Connect to the camera and initialize it.
+
+        Returns
+        -------
+        connected : bool
+            True if the camera is ready.
+
+        """
+        try:
+            server = epc_server(*self.address,
+                                timeout=self._config.get('server_timeout', 2))
+            imgDev = epc_image(server)
+            imager.imagerInit(server, imgDev)
+            if self._config.get('roi_readout', 0):
+                imgDev.setROI(*roi_from_config(self._config))
+        except (Exception, SystemExit) as e:
+            # epc_server exits if the camera does not answer, which must
+            # not stop the other cameras
+            print("[INFO]: Cant connect to server " + self.name)
+            print(str(e))
+            return False
+
+        self._acquisition = epc_acquisition(imgDev,
+                                            self._config['frame_queue_length'],
+                                            self._config['frame_drop_policy'])
+        self.connected = True
+        return True
+
+    def open(self):
+        """
+        Connect and start the camera, unless it was stopped meanwhile. It
+        blocks until the camera answered or timed out, so every camera is
+        opened in a thread of its own.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.connect():
+            with self._lock:
+                if not self._stopped:
+                    self.start()
+
+    def start(self):
+        """
+        Start the acquisition and the dispatcher.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._running = True
+        self._start_time = time.time()
+        self._acquisition.start()
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the dispatcher and the acquisition.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self._lock:
+            self._stopped = True
+            self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        if self._acquisition is not None:
+            self._acquisition.stop()
+
+    def _dispatch(self):
+        """
+        Hand the frames of this camera one after another to the pool. The
+        detection state needs the frames in order, so the next frame is
+        dispatched when the last one is done.
+        """
+        while self._running:
+            timestamp, dcs = self._acquisition.get(timeout=1)
+            if dcs is None:
+                if not self._acquisition.is_alive():
+                    break
+                continue
+
+            future = self._pool.submit(self._detector.process, dcs)
+            dist, ampl, height, pos_correct, directions = future.result()
+
+            self.frames_processed += 1
+            for direction in directions:
+                if direction == 1:
+                    self.entries += 1
+                else:
+                    self.exits += 1
+
+    def report(self):
+        """
+        Return the counters of the camera.
+
+        Returns
+        -------
+        report : dict
+            Count, entries, exits, processed, dropped and skipped frames
+            (no motion) and the throughput in frames per second.
+
+        """
+        fps = 0
+        if self._start_time is not None:
+            fps = self.frames_processed / (time.time() - self._start_time)
+        dropped = 0
+        if self._acquisition is not None:
+            dropped = self._acquisition.frames_dropped
+        return {'count': self.entries - self.exits,
+                'entries': self.entries,
+                'exits': self.exits,
+                'frames': self.frames_processed,
+                'dropped': dropped,
+                'skipped': self._detector.gate.frames_skipped,
+                'fps': fps}
+
+
+class Orchestrator:
+    """
+    Acquires from all cameras in parallel and processes their frames in a
+    shared pool.
+    """
+
+    def __init__(self, configs, workers=None):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        configs : list of dict
+            One configuration per camera.
+        workers : int, optional
+            Number of processing threads. The default is None, then the
+            number of CPUs is used.
+
+        Returns
+        -------
+        None.
+
+        """
+        if workers is None:
+            workers = os.cpu_count()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self.cameras = [Camera(config, self._pool) for config in configs]
+
+    def start(self):
+        """
+        Connect and start all reachable cameras, each in its own thread.
+
+        Returns
+        -------
+        None.
+
+        """
+        for camera in self.cameras:
+            threading.Thread(target=camera.open, daemon=True).start()
+
+    def stop(self):
+        """
+        Stop all cameras and the processing pool.
+
+        Returns
+        -------
+        None.
+
+        """
+        for camera in self.cameras:
+            camera.stop()
+        self._pool.shutdown()
+
+    def report(self):
+        """
+        Return the counters of all cameras.
+
+        Returns
+        -------
+        report : dict
+            The report of each camera, indexed by its name.
+
+        """
+        return {camera.name: camera.report() for camera in self.cameras}
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or ['config.ini']
+    configs = []
+    for path in paths:
+        if not os.path.exists(path):
+            print('No configuration-file found: ' + path)
+            exit()
+        configs.append(epc_config.load_config(path))
+
+    orchestrator = Orchestrator(configs)
+    orchestrator.start()
+    try:
+        while True:
+            time.sleep(5)
+            for name, report in orchestrator.report().items():
+                print('{}: count {count}, in {entries}, out {exits}, '
+                      'frames {frames}, dropped {dropped}, '
+                      'skipped {skipped}, '
+                      '{fps:.1f} fps'.format(name, **report))
+    except KeyboardInterrupt:
+        orchestrator.stop()
@@ -23,35 +23,27 @@ with h5py.File(path, 'r') as f:
     # List all groups
     a_group_key = list(f.keys())[0]
 
-    # Get the data
-    data = list(f[a_group_key])
+    # Get the data, shape (width, height, 4, frames) as saved by live_viewer
+    data = np.moveaxis(f[a_group_key][()], -1, 0)
 
 # get height and width of images
-height, _, width = data[0].shape
+_, width, height, _ = data.shape
 
-# create an empty offset-images and a random gray image
-d_offset = np.zeros((height, width))
+# create a random gray image
 gray = np.random.rand(height, width) * 30
 
 # convert the stream of dcs in distance, phase and amplitude
-distance = []
-phase = []
-amplitude = []
-for image in data:
-    tmp1, tmp2 = epc_math.calc_dist_phase(image, mod_frequ, d_offset)
-    distance.append(tmp1)
-    phase.append(tmp2)
-    amplitude.append(epc_math.calc_amplitude(image))
+distance, phase, amplitude = epc_math.convert_stack(data, mod_frequ)
 
 quality, noise = epc_math.check_signal_quality(amplitude[0], gray, exposure)
 
-background = np.ones((60, 200))
+background = np.ones((height, width))
 background *= 5.6
 
 print(quality, noise)
 
 # convert the images to height information
-distance2 = [-x + x.max() for x in distance]
+distance2 = distance.max(axis=(1, 2), keepdims=True) - distance
 
 # show the shifting center of gravity in the image stream
 cogs = []
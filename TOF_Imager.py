@@ -17,12 +17,12 @@ from PyQt5.QtGui import QImage, QPixmap, QIntValidator, QIcon
 from PyQt5.QtWidgets import QApplication, QMainWindow
 from PyQt5 import uic
 
-from collections import deque
-
 import cv2
-from epc_lib import epc_server, epc_image
-from epc_lib import epc_math
+from epc_lib import epc_server, epc_image, epc_acquisition
+from epc_lib import epc_config
+from epc_lib.epc_exposure import epc_exposure
 from imgProc import imgProcScale
+from imgProc.personDetector import PersonDetector, roi_from_config
 from imager import imager
 
 import time
@@ -77,29 +77,33 @@ class Thread(QThread):
         # TODO
         try:
             # Ethernet connection
-            self._server = epc_server(config['server_ip'])
+            self._server = epc_server(config['server_ip'],
+                                      config.get('server_port', 50660))
             self._image_epcDev = epc_image(self._server)
             imager.imagerInit(self._server, self._image_epcDev)
+            if config.get('roi_readout', 0):
+                self._image_epcDev.setROI(*roi_from_config(config))
             self._cam = True
         except Exception as e:
             print("[INFO]: Cant connect to server")
             print(str(e))
             self._cam = False
 
-        self.auto_background = False            # flag for auto background
         self._auto_exposure = False             # flag for auto exposure
         self._exposure = 1                      # exposure value
         self._update_cam = False                # flag when cam needs update
-        self._threshold = config['min_object_height']  # objects taller than 0.2m only
 
-        # image buffer for direction estimation
-        self._img_buffer = deque()
+        # gray view of the distance image, 4 times upscaled, in the RGB
+        # order of QImage.Format_RGB888
+        self._renderer = imgProcScale.DisplayRenderer(
+            scale=4, autoScale=False, colorMap=False, rotate=False, rgb=True)
 
-        # buffer for the position of the person
-        self._pos_buffer = []
+        # histogram based auto exposure
+        self._exposure_control = epc_exposure(
+            exposure_max=config['exposure_max'])
 
-        # buffer for the moving average
-        self._img_avg_buffer = deque(maxlen=config['img_avg_buffer_length'])
+        # background, height and direction estimation
+        self._detector = PersonDetector(config)
 
         # TODO for testing purposes only
         # with open(path1, 'rb') as file:
@@ -111,18 +115,20 @@ class Thread(QThread):
         # self.pool_data = cycle(data_dist)
         # self.pool_ampl = cycle(data_ampl)
 
-        # get height and width of images
-        height, width = config['img_height'], config['img_width']
-
-        # create random gray image
-        self._gray = np.random.rand(height, width)
-
-        # create a zero background image
-        self._background = np.zeros((height, width))
-
         # connect the slots
         self.update_config.connect(self._update_exposure)
 
+    @property
+    def auto_background(self):
+        """
+        Flag for auto background.
+        """
+        return self._detector.auto_background
+
+    @auto_background.setter
+    def auto_background(self, value):
+        self._detector.auto_background = value
+
     @pyqtSlot()
     def set_background(self):
         """
@@ -135,7 +141,7 @@ class Thread(QThread):
         """
         if self._cam:
             dist, phase, ampl = self._get_image()
-            self._background = dist
+            self._detector.background = dist
 
             dist = dist / dist.max() * 255
             dist = dist.astype('uint8')
@@ -148,10 +154,16 @@ class Thread(QThread):
             # request an update of the image in the viewer
             self.change_pixmap.emit(q, q)
 
-    def _get_image(self):
+    def _get_image(self, dcs=None):
         """
         Get the next image from the hardware.
 
+        Parameters
+        ----------
+        dcs : numpy array, optional
+            DCS images that were already captured, e.g. by a stream. The
+            default is None, then a single image is requested.
+
         Returns
         -------
         dist : numpy array
@@ -163,14 +175,10 @@ class Thread(QThread):
 
         """
         # capture image from hardware
-        dcs = self._image_epcDev.getDCSs()
+        if dcs is None:
+            dcs = self._image_epcDev.getDCSs()
 
-        # calculate the distance, phase and amplitude
-        dist, phase = epc_math.calc_dist_phase(dcs, config['mod_frequ'])
-        # correction of the distance error
-        dist = epc_math.distance_correction(dist, config['error_polynom'],
-                                            config['dist_offset'])
-        ampl = epc_math.calc_amplitude(dcs)
+        dist, phase, ampl = self._detector.get_image(dcs)
 
         # TODO for testing
         # dist = next(self.pool_data).astype('float32')
@@ -178,10 +186,6 @@ class Thread(QThread):
         # ampl = next(self.pool_ampl).astype('float32')
         # time.sleep(0.5)
 
-        # do some noise suppresion
-        dist = dist.astype('float32')
-        dist = cv2.medianBlur(dist, 7)
-
         return dist, phase, ampl
 
     def _get_height(self, image, background):
@@ -192,8 +196,8 @@ class Thread(QThread):
         ----------
         image : numpy array
             The distance image.
-        background : numpy array
-            The background image.
+        background : Background
+            The background.
 
         Returns
         -------
@@ -205,35 +209,7 @@ class Thread(QThread):
             Position of the person
 
         """
-        height = 0
-
-        base_height = np.median(background)
-        print("Base height: " + str(base_height))
-
-        # thresholding first
-        image[image > background - self._threshold] = base_height
-
-        # shift and flip
-        image = -1*(image - base_height)
-
-        # some gaussian blurring
-        img_blur = cv2.GaussianBlur(image, (15,5), 7)
-
-        # get the height
-        height = np.max(img_blur)
-        height = round(height, 2)
-        print("Height: " + str(height))
-
-        # get x-position of height
-        tmp_pos = np.argmax(img_blur)
-        pos = np.unravel_index(tmp_pos, img_blur.shape)
-        pos_correct = False
-        # check correct position for correct height calculation
-        min_pos = config['min_object_position']
-        max_pos = config['max_object_position']
-        if (min_pos < pos[1] < max_pos):
-            pos_correct = True
-        return height, pos_correct, pos
+        return self._detector.get_height(image, background)
 
     def _get_direction(self, image, background):
         """
@@ -243,7 +219,7 @@ class Thread(QThread):
         ----------
         image : numpy array
             The current image.
-        background: numpy array
+        background: Background
             The background.
 
         Returns
@@ -254,25 +230,30 @@ class Thread(QThread):
                                  undefined -> -1
 
         """
-        direction = -1
-        # get the 5th last image and get the center of gravity
-        img_last = self._img_buffer.popleft()
-        cog = imgProcScale.calc_image_cog(img_last, background,
-                                          False, self._threshold)
+        return self._detector.get_direction(image, background)
 
-        # calculate cog of new image and calculate difference
-        cog -= imgProcScale.calc_image_cog(image, background,
-                                           False, self._threshold)
+    def _background_view(self, background):
+        """
+        Convert the background into the scaled QImage of the viewer.
 
-        if cog[0] > 0:
-            direction = 0
-        elif cog[0] < 0:
-            direction = 1
+        Parameters
+        ----------
+        background : numpy array
+            The background image.
 
-        # append the current image to the image buffer
-        self._img_buffer.append(image)
+        Returns
+        -------
+        q : QImage
+            The normalized and scaled background image.
 
-        return direction
+        """
+        background = background / background.max() * 255
+        background = background.astype('uint8')
+        img_height, img_width = background.shape
+        convertToQtFormat = QImage(background, img_width, img_height,
+                                   QImage.Format_Grayscale8)
+        return convertToQtFormat.scaled(4*img_width, 4*img_height,
+                                        Qt.QtCore.Qt.IgnoreAspectRatio)
 
     def stop(self):
         """
@@ -296,105 +277,107 @@ class Thread(QThread):
         """
         self._running = True
 
+        # continuous acquisition in video mode in a separate thread, so the
+        # network transfer overlaps with the processing
+        acquisition = epc_acquisition(self._image_epcDev,
+                                      config['frame_queue_length'],
+                                      config['frame_drop_policy'])
+        acquisition.start()
+
         # fill the dist image buffer
         for idx in range(config['img_direction_buffer_length']):
-            dist, phase, ampl = self._get_image()
-            self._img_buffer.append(dist)
+            timestamp, dcs = acquisition.get()
+            dist, phase, ampl = self._get_image(dcs)
+            self._detector.fill_direction_buffer(dist)
 
         # put a dist image in the average buffer
-        self._img_avg_buffer.append(dist)
+        self._detector.seed_background(dist)
 
         while self._running and self._cam:
 
-            dist, phase, ampl = self._get_image()
+            timestamp, dcs = acquisition.get(timeout=1)
+            if dcs is None:
+                if not acquisition.is_alive():
+                    break
+                continue
 
-            if dist is not None:
+            dist, phase, ampl = self._get_image(dcs)
 
-                # put the image into the average
-                if self.auto_background:
-                    self._img_avg_buffer.append(dist)
-                    img_avg = 0
-                    for element in self._img_avg_buffer:
-                        img_avg += element
+            if dist is not None:
 
-                    img_avg /= len(self._img_avg_buffer)
+                # the height and the tracking only run while something is
+                # in the scene
+                motion = self._detector.has_motion(dist)
+
+                # put the image into the average, also while the scene is
+                # empty
+                img_avg = self._detector.update_background(dist)
+
+                # change exposure time if required by the amplitude
+                if self._auto_exposure:
+                    exposure = self._exposure_control.update(ampl)
+                    if exposure is not None:
+                        self._exposure = exposure
+                        self._update_cam = True
+
+                directions = []
+                if motion:
+                    # get the height and the height position
+                    height, pos_correct, pos = self._get_height(dist.copy(),
+                                                                img_avg)
+                    # track all persons, a person is new when its track
+                    # gets taller than min_person_height
+                    directions = self._detector.track_persons(dist, img_avg)
                 else:
-                    img_avg = self._background
-
-                # get some quality measures
-                quality, noise = epc_math.check_signal_quality(ampl,
-                                                               self._gray,
-                                                               self._exposure)
-                # pdb.set_trace()
-                # change exposure time if required by quality check
-                if quality == -1 and self._auto_exposure:
-                    self._exposure = self._exposure * 1.25
-                    # clip exposure at 4000 due to hardware limit
-                    if self._exposure > config['exposure_max']:
-                        self._exposure = config['exposure_max']
-                    self._update_cam = True
-                elif quality == 1 and self._auto_exposure:
-                    self._exposure = self._exposure * 0.9
-                    self._update_cam = True
-
-                # get the height and the height position
-                height, pos_correct, pos = self._get_height(dist.copy(),
-                                                            img_avg)
+                    height, pos_correct, pos = 0, False, None
                 self.change_height.emit(height, pos_correct)
 
-                # normalize gray image and convert to QImage and scale
-                img_view = dist.copy()
-                img_view = img_view / 2**12 * 255
-                img_view = img_view.astype('uint8')
-                img_height, img_width = img_view.shape
-                img_view = cv2.cvtColor(img_view, cv2.COLOR_GRAY2BGR)
-                # draw a circle around person, but only if taller than 0.2m
-                if height > config['min_object_height']:
-                    img_view = cv2.circle(img_view, (pos[1], pos[0]),
-                                          10, (0, 0, 255))
-
-
-                print("Circle dist:" + str(dist[pos[0], pos[1]]))
-
-                convertToQtFormat = QImage(img_view, img_width, img_height,
-                                           QImage.Format_RGB888)
-                p = convertToQtFormat.scaled(4*img_width, 4*img_height,
-                                             Qt.QtCore.Qt.IgnoreAspectRatio)
-
-                background = img_avg.copy()
-                background = background / background.max() * 255
-                background = background.astype('uint8')
-                convertToQtFormat = QImage(background, img_width, img_height,
-                                           QImage.Format_Grayscale8)
-                q = convertToQtFormat.scaled(4*img_width, 4*img_height,
-                                             Qt.QtCore.Qt.IgnoreAspectRatio)
+                # gray image with the invalid pixels marked, upscaled
+                img_view = self._renderer.render(dist, self._detector.flags)
+                img_height, img_width = img_view.shape[:2]
+                scale = self._renderer.scale
+
+                # draw a circle around every person taller than 0.2m
+                for track in self._detector.tracker.tracks:
+                    if track.missed == 0:
+                        row, col = np.round(track.centroid).astype(int)
+                        img_view = cv2.circle(img_view, (col*scale, row*scale),
+                                              10*scale, (0, 0, 255))
+
+                if pos is not None:
+                    print("Circle dist:" + str(dist[pos[0], pos[1]]))
+
+                # the image wraps the buffer of the renderer, which is reused
+                # for the next frames, the GUI thread gets its own copy
+                p = QImage(img_view, img_width, img_height, 3*img_width,
+                           QImage.Format_RGB888).copy()
+
+                # the background view only changes with the background
+                q = img_avg.cached('view', self._background_view)
 
                 # request an update of the image in the viewer
                 self.change_pixmap.emit(p, q)
-                # it is a new person, when the person is suddenly at a
-                # different place and taller than 1000
-                limit = config['min_person_height']
-                if self._pos_buffer == [0, 0] and height > limit:
-                    # check if person enters in upper or lower half
-                    # assuming it keeps direction
-                    if pos[0] < 30:
-                        direction = 1
-                    else:
-                        direction = 0
+                for direction in directions:
                     self.change_direction.emit(direction)
                     # give application time to redraw GUI
                     time.sleep(0.001)
                     self.new_person.emit()
-                elif height < limit:
-                    pos = [0, 0]
-                self._pos_buffer = pos
 
             if self._update_cam:
-                self._server.sendCommand('setIntegrationTime2D {}'.format(self._exposure))	 # t_int in us
-                self._server.sendCommand('setIntegrationTime3D {}'.format(self._exposure))	  # t_int in us
+                # both integration times in one round trip, only if changed
+                self._server.settings.set('setIntegrationTime2D', self._exposure)	 # t_int in us
+                self._server.settings.set('setIntegrationTime3D', self._exposure)	  # t_int in us
+                self._server.settings.apply()
                 self.update_gui.emit(self._exposure)
                 self._update_cam = False
 
+        # stop the acquisition and leave the video mode
+        acquisition.stop()
+        print("Frames acquired: {}, dropped: {}, skipped: {}".format(
+            acquisition.frames_acquired, acquisition.frames_dropped,
+            self._detector.gate.frames_skipped))
+        print(self._server.connection.timing.summary())
+
     @pyqtSlot(str, bool)
     def _update_exposure(self, value, auto):
         """
@@ -414,6 +397,7 @@ class Thread(QThread):
         """
         self._exposure = int(value)
         self._auto_exposure = auto
+        self._exposure_control.exposure = self._exposure
 
         # request change of settings in next cycle
         self._update_cam = True
@@ -681,21 +665,7 @@ if __name__ == '__main__':
     if not os.path.exists('config.ini'):
         print('No configuration-file found')
         exit()
-    with open('config.ini', 'r') as file:
-        lines = file.readlines()
-    config = {}
-    for line in lines:
-        key, value = line.split('=')
-        key = key.strip()
-        if key != 'error_polynom' and key != 'server_ip':
-            value = int(value.strip())
-        elif key == 'error_polynom':
-            value = np.fromstring(value, float, sep=',')
-        elif key == 'dist_offset':
-            value = float(value.strip())
-        elif key == 'server_ip':
-            value = value.strip()
-        config.update({key: value})
+    config = epc_config.load_config('config.ini')
     # load graphical user interface
     if not os.path.exists('TOF_Imager.ui'):
         print('No ui-file found')
@@ -24,3 +24,5 @@ import struct
 
 from epc_lib.epc_server import epc_server
 from epc_lib.epc_image import epc_image
+from epc_lib.epc_acquisition import epc_acquisition
+from epc_lib.epc_async import epc_async_client
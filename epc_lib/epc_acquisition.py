@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Acquisition thread that streams the images from the camera into a bounded
+queue, so the network transfer overlaps with the image processing of the
+consumer.
+"""
+
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+# policies if the queue is full
+DROP_OLDEST = 'drop_oldest'     # replace the oldest queued frame
+DROP_NEWEST = 'drop_newest'     # discard the frame that just arrived
+BLOCK = 'block'                 # wait until the consumer took a frame
+
+
+class epc_acquisition(threading.Thread):
+    """
+    Producer thread that fills a bounded queue with (timestamp, image)
+    tuples.
+
+    The images are copied into a fixed pool of preallocated buffers, a
+    buffer handed out by get() stays valid until the next call of get().
+    """
+
+    def __init__(self, imgDev, queue_length=2, policy=DROP_OLDEST,
+                 mode='dcs'):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        imgDev : epc_image
+            The initialized image device.
+        queue_length : int, optional
+            Maximum number of queued frames. The default is 2.
+        policy : str, optional
+            What to do if the queue is full: DROP_OLDEST, DROP_NEWEST or
+            BLOCK. The default is DROP_OLDEST.
+        mode : str, optional
+            'dcs' for the DCS images, 'distamp' for distance and amplitude.
+            The default is 'dcs'.
+
+        Returns
+        -------
+        None.
+
+        """
+        super().__init__(daemon=True)
+        if policy not in (DROP_OLDEST, DROP_NEWEST, BLOCK):
+            raise ValueError("Unknown frame drop policy '{}'".format(policy))
+
+        self._imgDev = imgDev
+        self._queue_length = queue_length
+        self._policy = policy
+        self._mode = mode
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._running = False
+        self._held = None
+
+        # one buffer for each queue entry, the consumer and the producer
+        if mode == 'dcs':
+            n_frames = imgDev.getNumberOfRecordedImageDataFrames()
+        else:
+            n_frames = 2
+        self._free = [imgDev.createFrameBuffer(n_frames)
+                      for i in range(queue_length + 2)]
+
+        self.frames_acquired = 0
+        self.frames_dropped = 0
+        self.error = None
+
+    def start(self):
+        """
+        Start the acquisition.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._running = True
+        super().start()
+
+    def run(self):
+        """
+        Called by start(); streams the images into the queue.
+
+        Returns
+        -------
+        None.
+
+        """
+        if self._mode == 'dcs':
+            stream = self._imgDev.streamDCSs()
+        else:
+            stream = self._imgDev.streamDistAmpl()
+
+        try:
+            for frame in stream:
+                timestamp = time.time()
+                if not self._running:
+                    break
+                slot = self._get_free_slot()
+                if slot is None:
+                    continue
+                np.copyto(slot, frame)
+                with self._cond:
+                    self._queue.append((timestamp, slot))
+                    self.frames_acquired += 1
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+            print("[INFO]: Acquisition stopped")
+            print(str(e))
+        finally:
+            stream.close()
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
+
+    def _get_free_slot(self):
+        """
+        Apply the drop policy and return a free buffer or None if the new
+        frame has to be dropped.
+        """
+        with self._cond:
+            if len(self._queue) >= self._queue_length:
+                if self._policy == BLOCK:
+                    while (len(self._queue) >= self._queue_length and
+                           self._running):
+                        self._cond.wait()
+                    if not self._running:
+                        return None
+                elif self._policy == DROP_NEWEST:
+                    self.frames_dropped += 1
+                    return None
+                else:
+                    _, old = self._queue.popleft()
+                    self._free.append(old)
+                    self.frames_dropped += 1
+            return self._free.pop()
+
+    def get(self, timeout=None):
+        """
+        Get the next frame from the queue. The buffer of the previous frame
+        is given back to the producer.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Maximum waiting time in seconds. The default is None (forever).
+
+        Returns
+        -------
+        timestamp : float
+            Time of the arrival of the frame, None if there is no frame.
+        frame : numpy array
+            The image, None if there is no frame.
+
+        """
+        with self._cond:
+            if self._held is not None:
+                self._free.append(self._held)
+                self._held = None
+                self._cond.notify_all()
+
+            if not self._cond.wait_for(
+                    lambda: self._queue or not self._running, timeout):
+                return None, None
+            if not self._queue:
+                return None, None
+
+            timestamp, self._held = self._queue.popleft()
+            self._cond.notify_all()
+            return timestamp, self._held
+
+    def stop(self):
+        """
+        Request the thread to stop and wait for it.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self.is_alive():
+            self.join()
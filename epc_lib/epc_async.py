@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio client for the server running on a DME660. It covers the command
+set of epc_server and epc_image, but raises exceptions instead of exiting
+the process, so several cameras can be polled from one event loop:
+
+    clients = [epc_async_client(ip) for ip in ips]
+    for client in clients:
+        await client.detectImageSize()
+    images = await asyncio.gather(*(c.getDCSs() for c in clients))
+"""
+
+import array
+import asyncio
+
+import numpy as np
+
+from epc_lib.epc_server import epc_server
+
+
+class epc_async_client:
+    """
+    Non-blocking client with one persistent connection. All requests are
+    serialized by a lock and limited by a timeout. If a request is
+    cancelled or times out, the connection is closed because the answer
+    would mess up the framing of the next request, the next request
+    reconnects automatically.
+    """
+
+    def __init__(self, serverIP="192.168.7.2", serverPort=50660, timeout=2.0):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        serverIP : str, optional
+            The IP address of the server. The default is "192.168.7.2".
+        serverPort : int, optional
+            The port of the server. The default is 50660.
+        timeout : float, optional
+            Timeout for each request in seconds. The default is 2.0.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.IP = serverIP
+        self.port = serverPort
+        self.timeout = timeout
+        self._N_REGS = 0x100
+
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+        self._numberOfColumns = None
+        self._numberOfRows = None
+        self._numberOfImageDataFrame = 4
+
+    def setImageSize(self, columns, rows, dataFrames=4):
+        """
+        Set the image geometry of the camera.
+
+        Parameters
+        ----------
+        columns : int
+            Number of columns.
+        rows : int
+            Number of rows.
+        dataFrames : int, optional
+            Number of DCS images. The default is 4.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._numberOfColumns = columns
+        self._numberOfRows = rows
+        self._numberOfImageDataFrame = dataFrames
+
+    async def detectImageSize(self):
+        """
+        Select the full ROI and set the image geometry from the IC type,
+        like imager.imagerInit.
+
+        Returns
+        -------
+        None.
+
+        """
+        await self.sendCommand('w 11 fa')
+        icType = await self.sendCommand('r 12')
+        if icType[0] == 2:
+            self.setImageSize(320, 240)
+        elif icType[0] == 4:
+            self.setImageSize(160, 60)
+        else:
+            raise ValueError("Unknown IC type {}".format(icType[0]))
+
+    async def close(self):
+        """
+        Close the connection.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._close()
+
+    async def sendCommand(self, command):
+        n_bytes = epc_server.replyLength(command)
+        if n_bytes is None:
+            # answer of unknown length
+            resp = await self._request(command, lambda r: r.read(100))
+        else:
+            resp = await self._request(command,
+                                       lambda r: r.readexactly(n_bytes))
+        ints = array.array('h', resp)
+        if len(ints) == 1 and ints[0] == -1:
+            raise RuntimeError("Server command '" + command + "' failed.")
+        return ints
+
+    async def i2c(self, arguments):
+        n_bytes = epc_server.replyLength(arguments)
+        if arguments[0] == 'w':
+            await self._request(arguments, lambda r: r.readexactly(n_bytes))
+            return 0
+        elif arguments[0] == 'r':
+            resp = await self._request(arguments,
+                                       lambda r: r.readexactly(n_bytes))
+            return array.array('h', resp)
+        raise ValueError("Invalid i2c command '" + arguments + "'")
+
+    async def getRegisterDump(self):
+        resp = await self._request('dumpAllRegisters',
+                                   lambda r: r.readexactly(self._N_REGS*2))
+        return np.frombuffer(resp, dtype='<i2')
+
+    async def readRegister(self, address):
+        return (await self.i2c("r %02X" % (address)))[0]
+
+    async def writeRegister(self, address, value):
+        await self.i2c("w %02X %02X" % (address, value))
+
+    async def getDCSs(self):
+        return await self._getImage('getDCSSorted',
+                                    self._numberOfImageDataFrame)
+
+    async def getDistAmpl(self):
+        return await self._getImage('getDistanceAndAmplitudeSorted', 2)
+
+    async def getDist(self):
+        return await self._getImage('getDistanceSorted', 1)
+
+    async def getAmpl(self):
+        return await self._getImage('getAmplitudeSorted', 1)
+
+    async def getTemperature(self):
+        resp = await self._request('getTemperature',
+                                   lambda r: r.readexactly(2))
+        return np.frombuffer(resp, dtype='<u2').tolist()
+
+    async def _getImage(self, command, numberOfElements):
+        if self._numberOfRows is None:
+            raise RuntimeError("Image size unknown, call setImageSize or "
+                               "detectImageSize first.")
+        n_bytes = (numberOfElements * self._numberOfRows *
+                   self._numberOfColumns * 2)
+        resp = await self._request(command, lambda r: r.readexactly(n_bytes))
+        imageData = np.frombuffer(resp, dtype='<u2')
+        return np.transpose(np.reshape(imageData, (numberOfElements,
+                                                   self._numberOfRows,
+                                                   self._numberOfColumns)),
+                            [2, 1, 0])
+
+    async def _request(self, command, receive):
+        """
+        Send the command and await the answer read by receive(reader).
+        """
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    return await asyncio.wait_for(
+                        self._transfer(command, receive), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    # stale connection, the server hung up before answering
+                    self._close()
+                    if attempt or getattr(e, 'partial', b''):
+                        raise
+                except BaseException:
+                    # timeout or cancellation
+                    self._close()
+                    raise
+
+    async def _transfer(self, command, receive):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                self.IP, self.port)
+        self._writer.write((command + "\n").encode())  # support for C++ server
+        await self._writer.drain()
+        resp = await receive(self._reader)
+        if not resp:
+            raise ConnectionError("Server closed connection on '"
+                                  + command + "'")
+        return resp
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the implementations of the hot image kernels. Every backend
+provides the same kernels:
+
+    dist_phase_ampl(dcs, led_mod_freq, out)   see epc_math.calc_dist_phase_ampl
+    correction(phase, lut, out)               see epc_math.distance_from_phase
+    threshold(image, background, thresh, out) uint8 mask image < background - thresh
+
+'numpy' is the reference, 'threaded' splits the images into row tiles that
+are processed in a thread pool, 'numba' is registered if numba is
+installed. select_backend measures all available backends for the sensor
+geometry and uses the fastest. All backends accept the same arguments as the reference,
+e.g. stacks of images and out as one array or as a tuple of arrays. The
+noise suppression is imgProc.denoise.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from epc_lib import epc_math
+
+
+_backends = {}
+_current = 'numpy'
+_pool = None
+
+# results of the last select_backend, backend name -> time per frame in ms
+benchmark_results = {}
+
+
+def register_backend(name, kernels):
+    """
+    Register a backend.
+
+    Parameters
+    ----------
+    name : str
+        The name of the backend.
+    kernels : dict
+        The kernel functions by name, see the module description.
+
+    Returns
+    -------
+    None.
+
+    """
+    _backends[name] = kernels
+
+
+def available_backends():
+    """
+    Return the names of the registered backends.
+    """
+    return list(_backends)
+
+
+def use_backend(name):
+    """
+    Select the backend returned by get_backend.
+
+    Parameters
+    ----------
+    name : str
+        The name of a registered backend.
+
+    Returns
+    -------
+    None.
+
+    """
+    global _current
+    if name not in _backends:
+        raise ValueError('Unknown backend {}, available: {}'.format(
+            name, ', '.join(_backends)))
+    _current = name
+
+
+def get_backend():
+    """
+    Return the kernels of the selected backend.
+
+    Returns
+    -------
+    kernels : dict
+        The kernel functions by name.
+
+    """
+    return _backends[_current]
+
+
+def current_backend():
+    """
+    Return the name of the selected backend.
+    """
+    return _current
+
+
+def select_backend(height, width, repeats=20):
+    """
+    Measure all backends on synthetic images of the sensor geometry and
+    select the fastest one. The times are kept in benchmark_results.
+
+    Parameters
+    ----------
+    height : int
+        Number of rows of the images.
+    width : int
+        Number of columns of the images.
+    repeats : int, optional
+        Number of measured frames per backend. The default is 20.
+
+    Returns
+    -------
+    name : str
+        The name of the selected backend.
+
+    """
+    rng = np.random.default_rng(0)
+    dcs = rng.integers(0, 4096, (width, height, 4)).astype(np.uint16)
+    background = np.full((height, width), 2500, dtype=np.float32)
+    lut, _ = epc_math.distance_lut(20, [0.0], 0)
+    out = np.empty((3, height, width), dtype=np.float32)
+    mask = np.empty((height, width), dtype=np.uint8)
+
+    benchmark_results.clear()
+    for name, kernels in _backends.items():
+        def frame():
+            dist, phase, ampl = kernels['dist_phase_ampl'](dcs, 20, out)
+            kernels['correction'](phase, lut, dist)
+            kernels['threshold'](dist, background, 200, mask)
+
+        try:
+            frame()  # warm up, e.g. compilation
+            start = time.perf_counter()
+            for i in range(repeats):
+                frame()
+        except Exception as e:
+            print("[INFO]: Backend {} failed: {}".format(name, e))
+            continue
+        benchmark_results[name] = (time.perf_counter() - start) / repeats * 1000
+
+    use_backend(min(benchmark_results, key=benchmark_results.get))
+    print("[INFO]: Compute backend {} selected ({})".format(
+        _current, ', '.join('{} {:.3f} ms'.format(name, t)
+                            for name, t in benchmark_results.items())))
+    return _current
+
+
+# numpy reference
+
+def _threshold(image, background, thresh, out=None):
+    if out is None:
+        out = np.empty(image.shape, dtype=np.uint8)
+    limit = np.subtract(background, thresh, dtype=np.float32)
+    return np.less(image, limit, out=out.view(bool)).view(np.uint8)
+
+
+register_backend('numpy', {
+    'dist_phase_ampl': lambda dcs, led_mod_freq, out=None:
+        epc_math.calc_dist_phase_ampl(dcs, led_mod_freq, out=out),
+    'correction': lambda phase, lut, out=None:
+        epc_math.distance_from_phase(phase, lut, out=out),
+    'threshold': _threshold,
+})
+
+
+# row tiles in a thread pool, NumPy releases the GIL
+
+def _tiles(n_rows):
+    """
+    Split the rows into one tile per thread. Returns (start, stop) of every
+    tile.
+    """
+    n_tiles = min(os.cpu_count() or 1, max(n_rows // 8, 1))
+    bounds = np.linspace(0, n_rows, n_tiles + 1).astype(int)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _run_tiles(function, n_rows):
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+    for future in [_pool.submit(function, tile) for tile in _tiles(n_rows)]:
+        future.result()
+
+
+def _threaded_dist_phase_ampl(dcs, led_mod_freq, out=None):
+    if out is None:
+        shape = (3,) + dcs.shape[:-3] + (dcs.shape[-2], dcs.shape[-3])
+        out = np.empty(shape, dtype=np.float32)
+
+    def tile(rows):
+        # the rows of the result are the second last axis of the dcs
+        epc_math.calc_dist_phase_ampl(dcs[..., rows[0]:rows[1], :],
+                                      led_mod_freq,
+                                      out=[image[..., rows[0]:rows[1], :]
+                                           for image in out])
+
+    _run_tiles(tile, out[0].shape[-2])
+    return out
+
+
+def _threaded_correction(phase, lut, out=None):
+    if out is None:
+        out = np.empty(phase.shape, dtype=np.float32)
+
+    def tile(rows):
+        epc_math.distance_from_phase(phase[rows[0]:rows[1]], lut,
+                                     out=out[rows[0]:rows[1]])
+
+    _run_tiles(tile, phase.shape[0])
+    return out
+
+
+def _threaded_threshold(image, background, thresh, out=None):
+    if out is None:
+        out = np.empty(image.shape, dtype=np.uint8)
+
+    def tile(rows):
+        _threshold(image[rows[0]:rows[1]], background[rows[0]:rows[1]],
+                   thresh, out=out[rows[0]:rows[1]])
+
+    _run_tiles(tile, image.shape[0])
+    return out
+
+
+register_backend('threaded', {
+    'dist_phase_ampl': _threaded_dist_phase_ampl,
+    'correction': _threaded_correction,
+    'threshold': _threaded_threshold,
+})
+
+
+# numba, only if installed
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _numba_dist_phase_ampl_kernel(dcs, factor, dist, phase, ampl):
+        width, height = dcs.shape[0], dcs.shape[1]
+        for y in numba.prange(height):
+            for x in range(width):
+                a = np.float32(dcs[x, y, 2]) - np.float32(dcs[x, y, 0])
+                b = np.float32(dcs[x, y, 3]) - np.float32(dcs[x, y, 1])
+                p = np.arctan2(b, a) + np.float32(np.pi)
+                dist[y, x] = p * factor
+                phase[y, x] = p
+                ampl[y, x] = np.float32(0.5) * np.sqrt(a * a + b * b)
+
+    @numba.njit(parallel=True, cache=True)
+    def _numba_correction_kernel(phase, lut, scale, out):
+        height, width = phase.shape
+        for y in numba.prange(height):
+            for x in range(width):
+                out[y, x] = lut[int(phase[y, x] * scale + np.float32(0.5))]
+
+    @numba.njit(parallel=True, cache=True)
+    def _numba_threshold_kernel(image, background, thresh, out):
+        height, width = image.shape
+        for y in numba.prange(height):
+            for x in range(width):
+                out[y, x] = image[y, x] < background[y, x] - thresh
+
+    def _numba_dist_phase_ampl(dcs, led_mod_freq, out=None):
+        if dcs.ndim != 3:
+            # stacks are left to numpy
+            return epc_math.calc_dist_phase_ampl(dcs, led_mod_freq, out=out)
+        if out is None:
+            out = np.empty((3, dcs.shape[1], dcs.shape[0]), dtype=np.float32)
+        factor = np.float32(3e8 / (led_mod_freq * 1E6) / np.pi / 4 * 1000)
+        _numba_dist_phase_ampl_kernel(dcs, factor, *out)
+        return out
+
+    def _numba_correction(phase, lut, out=None):
+        if out is None:
+            out = np.empty(phase.shape, dtype=np.float32)
+        scale = np.float32((lut.size - 1) / (2 * np.pi))
+        _numba_correction_kernel(phase, lut, scale, out)
+        return out
+
+    def _numba_threshold(image, background, thresh, out=None):
+        if out is None:
+            out = np.empty(image.shape, dtype=np.uint8)
+        _numba_threshold_kernel(image, background, np.float32(thresh), out)
+        return out
+
+    register_backend('numba', {
+        'dist_phase_ampl': _numba_dist_phase_ampl,
+        'correction': _numba_correction,
+        'threshold': _numba_threshold,
+    })
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Parser for the configuration files of the ToF Imager, see config.ini.
+"""
+
+import numpy as np
+
+
+# keys whose values are kept as string
+STRING_KEYS = ('server_ip', 'frame_drop_policy', 'compute_backend',
+               'background_model', 'denoise_filter', 'roi', 'roi_mask')
+
+
+def load_config(path='config.ini'):
+    """
+    Read a configuration file with one 'key=value' pair per line.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the configuration file. The default is 'config.ini'.
+
+    Returns
+    -------
+    config : dict
+        The configuration.
+
+    """
+    with open(path, 'r') as file:
+        lines = file.readlines()
+    config = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        key, value = line.split('=')
+        key = key.strip()
+        if key == 'error_polynom':
+            value = np.fromstring(value, float, sep=',')
+        elif key in STRING_KEYS:
+            value = value.strip()
+        else:
+            value = int(value.strip())
+        config.update({key: value})
+    return config
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent TCP connection to a server running on a DME660. The connections
+are pooled per server address so that epc_server and epc_image share one
+open socket instead of connecting and closing for every request.
+"""
+
+import select
+import socket
+import threading
+
+from epc_lib.epc_timing import epc_timing
+
+
+# pool of the open connections, indexed by (serverIP, serverPort)
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def get_connection(serverIP, serverPort, timeout=None):
+    """
+    Return the shared connection to the given server, create it if needed.
+
+    Parameters
+    ----------
+    serverIP : str
+        The IP address of the server.
+    serverPort : int
+        The port of the server.
+    timeout : float, optional
+        Socket timeout in seconds. The default is None (blocking).
+
+    Returns
+    -------
+    connection : epc_connection
+        The shared connection object.
+
+    """
+    with _pool_lock:
+        key = (serverIP, serverPort)
+        if key not in _pool:
+            _pool[key] = epc_connection(serverIP, serverPort, timeout)
+        return _pool[key]
+
+
+def close_all():
+    """
+    Close all pooled connections.
+
+    Returns
+    -------
+    None.
+
+    """
+    with _pool_lock:
+        for connection in _pool.values():
+            connection.close()
+
+
+class epc_connection:
+    """
+    A single persistent socket to the server. The socket is opened lazily
+    and re-opened once if the server closed it in the meantime.
+
+    All requests are serialized by a lock, so the object can be shared
+    between the acquisition thread and the GUI thread. The durations of
+    the request phases are recorded in timing.
+    """
+
+    def __init__(self, serverIP, serverPort, timeout=None):
+        self.IP = serverIP
+        self.port = serverPort
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self._socket = None
+        self._pending = None
+        self.timing = epc_timing()
+
+    def connect(self):
+        """
+        Open the socket if it is not already open.
+
+        Returns
+        -------
+        s : socket
+            The open socket.
+
+        """
+        if self._socket is None:
+            s = socket.create_connection((self.IP, self.port), self.timeout)
+            # small commands must not wait for Nagle
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._socket = s
+        return self._socket
+
+    def close(self):
+        """
+        Close the socket. The next request reconnects automatically.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            self._pending = None
+            if self._socket is not None:
+                try:
+                    self._socket.close()
+                except OSError:
+                    pass
+                self._socket = None
+
+    def query(self, command, n_bytes):
+        """
+        Send a command and receive exactly n_bytes of response.
+
+        Parameters
+        ----------
+        command : str
+            The command without line ending.
+        n_bytes : int
+            The number of bytes of the response.
+
+        Returns
+        -------
+        data : bytearray
+            The response.
+
+        """
+        data = bytearray(n_bytes)
+        self.query_into(command, data)
+        return data
+
+    def query_any(self, command, max_bytes, quiet=0.005):
+        """
+        Send a command whose response has no known length and receive at
+        most max_bytes. The response is complete when no further bytes
+        arrive within quiet seconds, so a response split into several TCP
+        segments is joined. If the server sends more than max_bytes, the
+        connection is reset, so the surplus can not corrupt the next
+        response. Every call waits for the quiet time, use query for
+        responses of known length.
+
+        Parameters
+        ----------
+        command : str
+            The command without line ending.
+        max_bytes : int
+            The maximum number of bytes of the response.
+        quiet : float, optional
+            Time in seconds without data that ends the response. The
+            default is 0.005.
+
+        Returns
+        -------
+        data : bytes
+            The response.
+
+        """
+        with self.lock:
+            data = bytearray(self._request(command,
+                                           lambda s: s.recv(max_bytes)))
+            start = self.timing.start()
+            while select.select([self._socket], [], [], quiet)[0]:
+                try:
+                    chunk = self._socket.recv(max_bytes + 1 - len(data))
+                except OSError:
+                    chunk = b''
+                data += chunk
+                if not chunk or len(data) > max_bytes:
+                    # closed by the server or longer than expected
+                    self.close()
+                    break
+            self.timing.mark(command, 'payload', start)
+            return bytes(data[:max_bytes])
+
+    def query_into(self, command, buffer):
+        """
+        Send a command and receive the response directly into buffer until
+        it is full.
+
+        Parameters
+        ----------
+        command : str
+            The command without line ending.
+        buffer : bytearray, memoryview or numpy array
+            Writable, contiguous buffer that receives the response.
+
+        Returns
+        -------
+        None.
+
+        """
+        buffer = memoryview(buffer).cast('B')
+        with self.lock:
+            n_bytes = self._request(command, lambda s: s.recv_into(buffer))
+            start = self.timing.start()
+            self.recv_into(buffer[n_bytes:])
+            self.timing.mark(command, 'payload', start)
+
+    def query_batch(self, commands, n_bytes):
+        """
+        Send several commands at once and receive their answers in one
+        round trip. The length of every answer has to be known.
+
+        Parameters
+        ----------
+        commands : list of str
+            The commands without line ending.
+        n_bytes : int or list of int
+            The number of bytes of the answer of each command, one for all
+            or one per command.
+
+        Returns
+        -------
+        data : list of bytearray
+            The answers, one per command.
+
+        """
+        if isinstance(n_bytes, int):
+            n_bytes = [n_bytes] * len(commands)
+        data = bytearray(sum(n_bytes))
+        self.query_into("\n".join(commands), data)
+        offsets = [0]
+        for n in n_bytes:
+            offsets.append(offsets[-1] + n)
+        return [data[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+    def prefetch(self, command, buffer):
+        """
+        Send a command without waiting for the answer. The answer is
+        received into buffer by complete() or, at the latest, before the
+        next request is sent, so requests of other threads can be mixed in.
+
+        Parameters
+        ----------
+        command : str
+            The command without line ending.
+        buffer : bytearray, memoryview or numpy array
+            Writable, contiguous buffer that receives the response.
+
+        Returns
+        -------
+        None.
+
+        """
+        buffer = memoryview(buffer).cast('B')
+        with self.lock:
+            self.complete()
+            start = self.timing.start()
+            try:
+                self.connect().sendall((command + "\n").encode())
+            except OSError:
+                # stale connection, try again once
+                self.close()
+                self.connect().sendall((command + "\n").encode())
+            self.timing.mark(command, 'send', start)
+            self._pending = (command, buffer)
+
+    def complete(self):
+        """
+        Receive the answer of a prefetched command, if there is one.
+
+        Returns
+        -------
+        None.
+
+        """
+        with self.lock:
+            if self._pending is not None:
+                (command, buffer), self._pending = self._pending, None
+                start = self.timing.start()
+                self.recv_into(buffer[:1])
+                start = self.timing.mark(command, 'first_byte', start)
+                self.recv_into(buffer[1:])
+                self.timing.mark(command, 'payload', start)
+
+    def recv_into(self, buffer):
+        """
+        Receive from the open socket until buffer is full.
+
+        Parameters
+        ----------
+        buffer : memoryview
+            Writable buffer that receives the data.
+
+        Returns
+        -------
+        None.
+
+        """
+        remaining = len(buffer)
+        offset = 0
+        while remaining > 0:
+            try:
+                n_bytes = self._socket.recv_into(buffer[offset:], remaining)
+            except OSError:
+                self.close()
+                raise
+            if n_bytes == 0:
+                self.close()
+                raise ConnectionError("Server closed connection during "
+                                      "transfer")
+            offset += n_bytes
+            remaining -= n_bytes
+
+    def _request(self, command, receive):
+        """
+        Send the command and call receive on the socket to get the first
+        part of the answer. A stale socket is reconnected once.
+        """
+        command += "\n"  # support for C++ server
+        with self.lock:
+            self.complete()
+            for attempt in range(2):
+                try:
+                    start = self.timing.start()
+                    if self._socket is None:
+                        self.connect()
+                        start = self.timing.mark(command, 'connect', start)
+                    s = self._socket
+                    s.sendall(command.encode())
+                    start = self.timing.mark(command, 'send', start)
+                    result = receive(s)
+                    self.timing.mark(command, 'first_byte', start)
+                except OSError:
+                    self.close()
+                    if attempt:
+                        raise
+                    continue
+                if result:
+                    return result
+                # the server hung up before answering
+                self.close()
+        raise ConnectionError("Server closed connection on '"
+                              + command[:-1] + "'")
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Auto exposure from the amplitude histogram. The amplitude is about
+proportional to the integration time, so the controller jumps directly to
+the integration time that puts the bright pixels at the target amplitude.
+"""
+
+import numpy as np
+
+
+class epc_exposure:
+    """
+    Controller of the integration time. update() is called with every
+    amplitude image and returns a new integration time only if it is
+    outside the dead band, at most every settle_frames frames:
+
+        exposure = control.update(ampl)
+        if exposure is not None:
+            settings.set('setIntegrationTime2D', exposure)
+            settings.set('setIntegrationTime3D', exposure)
+            settings.apply()
+    """
+
+    def __init__(self, exposure=1000, exposure_min=10, exposure_max=4000,
+                 target=1000, percentile=95, saturation=2000,
+                 max_saturated=0.02, dead_band=0.2, max_step=4.0,
+                 settle_frames=3, subsample=2, bins=256):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        exposure : int, optional
+            The current integration time in us. The default is 1000.
+        exposure_min : int, optional
+            Lowest integration time in us. The default is 10.
+        exposure_max : int, optional
+            Highest integration time in us, the hardware limit is 4000. The
+            default is 4000.
+        target : float, optional
+            Target amplitude of the percentile. The default is 1000.
+        percentile : float, optional
+            Percentile of the amplitude that is controlled. The default is
+            95.
+        saturation : float, optional
+            Amplitude from which a pixel counts as saturated. The default
+            is 2000.
+        max_saturated : float, optional
+            Fraction of saturated pixels that is tolerated. The default is
+            0.02.
+        dead_band : float, optional
+            Relative change of the integration time below which nothing
+            changes (hysteresis). The default is 0.2.
+        max_step : float, optional
+            Largest factor of one change. The default is 4.0.
+        settle_frames : int, optional
+            Frames to wait after a change until the images show the new
+            integration time (queued frames). The default is 3.
+        subsample : int, optional
+            Use every n-th row and column for the histogram. The default
+            is 2.
+        bins : int, optional
+            Number of histogram bins between 0 and saturation. The default
+            is 256.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.exposure = exposure
+        self.exposure_min = exposure_min
+        self.exposure_max = exposure_max
+        self.target = target
+        self.percentile = percentile
+        self.saturation = saturation
+        self.max_saturated = max_saturated
+        self.dead_band = dead_band
+        self.max_step = max_step
+        self.settle_frames = settle_frames
+        self.subsample = subsample
+        self.bins = bins
+
+        self._wait = 0
+
+    def histogram(self, ampl):
+        """
+        Calculate the histogram of the amplitude on the subsampled grid.
+
+        Parameters
+        ----------
+        ampl : numpy array
+            The amplitude image.
+
+        Returns
+        -------
+        hist : numpy array, shape (bins + 1,)
+            Number of pixels per bin, the last bin counts the saturated
+            pixels.
+
+        """
+        ampl = ampl[::self.subsample, ::self.subsample]
+        index = np.multiply(ampl, self.bins / self.saturation,
+                            dtype=np.float32)
+        np.clip(index, 0, self.bins, out=index)
+        return np.bincount(index.astype(np.intp).ravel(),
+                           minlength=self.bins + 1)
+
+    def update(self, ampl):
+        """
+        Calculate the integration time for the next frames.
+
+        Parameters
+        ----------
+        ampl : numpy array
+            The amplitude image, taken with the current integration time.
+
+        Returns
+        -------
+        exposure : int
+            The new integration time in us or None, if it stays.
+
+        """
+        if self._wait > 0:
+            self._wait -= 1
+            return None
+
+        hist = self.histogram(ampl)
+        n_pixels = hist.sum()
+        saturated = hist[-1] / n_pixels
+
+        # amplitude of the percentile, linear within the bin
+        cumsum = np.cumsum(hist[:-1])
+        rank = self.percentile / 100 * n_pixels
+        if saturated > self.max_saturated or rank > cumsum[-1]:
+            # the percentile is saturated, the amplitude is unknown
+            ratio = 1 / self.max_step
+            if saturated <= 2 * self.max_saturated:
+                ratio = 0.5
+        else:
+            index = np.searchsorted(cumsum, rank)
+            below = cumsum[index - 1] if index > 0 else 0
+            fraction = (rank - below) / max(hist[index], 1)
+            level = (index + fraction) * self.saturation / self.bins
+            ratio = self.target / max(level, 1e-3)
+
+        ratio = min(max(ratio, 1 / self.max_step), self.max_step)
+        exposure = min(max(self.exposure * ratio, self.exposure_min),
+                       self.exposure_max)
+        exposure = int(round(exposure))
+
+        # hysteresis: small deviations are left alone
+        if abs(exposure - self.exposure) <= self.dead_band * self.exposure:
+            return None
+
+        self.exposure = exposure
+        self._wait = self.settle_frames
+        return exposure
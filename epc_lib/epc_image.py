@@ -12,89 +12,124 @@
 # Official Libraries
 import sys
 import numpy as np
-import socket
 import struct
 
 class epc_image:
 
+    # index of the modulation frequencies in MHz for setModulationFrequency,
+    # only those known from imager.imagerInit
+    MODULATION_FREQUENCIES = {20: 0, 10: 1}
+
     def __init__(self, epc_server):
         self._server = epc_server
 
-    def getDCSs(self):
-        s = socket.create_connection((self._server.IP, self._server.port))
-        command = 'getDCSSorted\n'
-        s.send(command.encode())
-
-        imageDataVector = bytearray()
-        remaining = self._imageSizeBytesAllDCSs
-        while remaining > 0:
-            chunk = s.recv(remaining)       # Get available data.
-            imageDataVector.extend(chunk)   # Add to already stored data.
-            remaining -= len(chunk)
-
-        s.close()
-        return self._imageVectorToArray(imageDataVector, self._numberOfImageDataFrame)
-
-    def getDistAmpl(self):
-        s = socket.create_connection((self._server.IP, self._server.port))
-        command='getDistanceAndAmplitudeSorted\n'
-        s.send(command.encode())
-
-        imageDataVector = bytearray()
-        remaining = (self._imageSizeBytes) * 2
-        while remaining > 0:
-            chunk = s.recv(remaining)       # Get available data.
-            imageDataVector.extend(chunk)   # Add to already stored data.
-            remaining -= len(chunk)
-
-        s.close()
-        return self._imageVectorToArray(imageDataVector, 2)
-
-    def getDist(self):
-        s = socket.create_connection((self._server.IP, self._server.port))
-        command='getDistanceSorted\n'
-        s.send(command.encode())
-
-        imageDataVector = bytearray()
-        remaining = (self._imageSizeBytes) * 2
-        while remaining > 0:
-            chunk = s.recv(remaining)       # Get available data.
-            imageDataVector.extend(chunk)   # Add to already stored data.
-            remaining -= len(chunk)
-
-        s.close()
-        return self._imageVectorToArray(imageDataVector, 1)
-
-    def getAmpl(self):
-        s = socket.create_connection((self._server.IP, self._server.port))
-        command='getAmplitudeSorted\n'
-        s.send(command.encode())
-
-        imageDataVector = bytearray()
-        remaining = (self._imageSizeBytes) * 2
-        while remaining > 0:
-            chunk = s.recv(remaining)       # Get available data.
-            imageDataVector.extend(chunk)   # Add to already stored data.
-            remaining -= len(chunk)
-
-        s.close()
-        return self._imageVectorToArray(imageDataVector, 1)
+    def getDCSs(self, out=None):
+        """
+            Returns the DCS images with shape (columns, rows, DCSs). Without
+            'out' the array is a reused receive buffer that is overwritten by
+            the next call, copy it to keep it.
+        """
+        return self._receiveImage('getDCSSorted', self._numberOfImageDataFrame, out)
+
+    def getDistAmpl(self, out=None):
+        """
+            Returns the distance and amplitude image with shape (columns,
+            rows, 2). Without 'out' the array is a reused receive buffer that
+            is overwritten by the next call, copy it to keep it.
+        """
+        return self._receiveImage('getDistanceAndAmplitudeSorted', 2, out)
+
+    def getDist(self, out=None):
+        """
+            Returns the distance image with shape (columns, rows, 1). Without
+            'out' the array is a reused receive buffer that is overwritten by
+            the next call, copy it to keep it.
+        """
+        return self._receiveImage('getDistanceSorted', 1, out)
+
+    def getAmpl(self, out=None):
+        """
+            Returns the amplitude image with shape (columns, rows, 1).
+            Without 'out' the array is a reused receive buffer that is
+            overwritten by the next call, copy it to keep it.
+        """
+        return self._receiveImage('getAmplitudeSorted', 1, out)
+
+    def getDCSsDualFrequency(self, frequencies=(20, 10), out=None):
+        """
+            Returns the DCS images of two modulation frequencies in MHz for
+            epc_math.calc_dist_dual_frequency, in the order of 'frequencies'.
+            The frequencies are acquired starting with the one currently
+            set, so consecutive calls change the frequency only once per
+            call. Without 'out' the arrays are overwritten by the next call.
+        """
+        settings = self._server.settings
+        if out is None:
+            out = self._frameBuffers.get('dual')
+            if out is None:
+                out = [self.createFrameBuffer(self._numberOfImageDataFrame) for i in range(2)]
+                self._frameBuffers['dual'] = out
+
+        order = [0, 1]
+        if settings.get('setModulationFrequency') == str(self.MODULATION_FREQUENCIES[frequencies[1]]):
+            order = [1, 0]
+        for i in order:
+            settings.set('setModulationFrequency', self.MODULATION_FREQUENCIES[frequencies[i]])
+            settings.apply()
+            self.getDCSs(out=out[i])
+        return out
+
+    def streamDCSs(self, video=True):
+        """
+            Generator that yields the DCS images continuously. The request
+            for the next frame is sent before a frame is handed out, so the
+            transfer overlaps with the processing of the caller. With 'video'
+            the camera runs in video mode while the generator is active.
+
+            A yielded array is valid until the next iteration. Temperature
+            and register access from any thread stays possible in between.
+        """
+        return self._streamImage('getDCSSorted', self._numberOfImageDataFrame, video)
+
+    def streamDistAmpl(self, video=True):
+        return self._streamImage('getDistanceAndAmplitudeSorted', 2, video)
+
+    def getTimingStatistics(self):
+        """
+            Returns the rolling statistics of the request phases in ms,
+            see epc_timing.statistics. Disable the timing with
+            setTimingEnabled(False).
+        """
+        return self._server.connection.timing.statistics()
+
+    def setTimingEnabled(self, enabled):
+        self._server.connection.timing.enabled = enabled
 
     def getTemperature(self):
-        s = socket.create_connection((self._server.IP, self._server.port))
-        command='getTemperature\n'
-        s.send(command.encode())
-        tempVector = bytearray()
-        chunk = s.recv(2)       # Get available data.
-        tempVector=chunk
-        s.close()
+        connection = self._server.connection
+        tempVector = connection.query('getTemperature', 2)
 
+        start = connection.timing.start()
         unpackedString = 'H' * (int(tempVector.__len__()/2)) # signed short (16bit)
         tempData16bit = list(struct.unpack('<'+unpackedString, tempVector)) # little endian
+        connection.timing.mark('getTemperature', 'decode', start)
 
         return tempData16bit
 
 
+    def setROI(self, left, top, right, bottom):
+        """
+            Lets the camera read out only the columns left..right-1 and the
+            rows top..bottom-1 and sizes the images accordingly. The sensor
+            may restrict the possible rectangles, see the server manual.
+        """
+        settings = self._server.settings
+        settings.set('setROI', '{} {} {} {}'.format(left, top, right - 1, bottom - 1))
+        settings.apply()
+        self.setNumberOfRecordedColumns(right - left)
+        self.setNumberOfRecordedRows(bottom - top)
+        self.updateNbrRecordedBytes()
+
     def setNumberOfRecordedColumns(self, NbrMeasCols):
         self._numberOfColumns  = NbrMeasCols
 
@@ -117,14 +152,52 @@ class epc_image:
         self._imageSizeBytes        = self._numberOfRows * self._numberOfColumns * 2
         self._imageSizeBytesAllDCSs = self._numberOfImageDataFrame * self._imageSizeBytes
 
-    def _imageVectorToArray(self, imageDataVector, numberOfElements):
-        imageDataVector = bytes(imageDataVector)
-
-        unpackedString = 'H' * (int(imageDataVector.__len__() / 2))  # signed short (16bit)
-
-        imageData16bit = list(struct.unpack('<' + unpackedString, imageDataVector))  # little endian
-
-        # Store data directly as numpy array:
-        imageData = np.transpose(np.reshape(np.array(imageData16bit, dtype='uint16'), (numberOfElements, self._numberOfRows, self._numberOfColumns)), [2, 1, 0])
-
-        return imageData
+        # reusable receive buffers, indexed by the command and 'dual' for
+        # the pair of getDCSsDualFrequency
+        self._frameBuffers = {}
+
+    def createFrameBuffer(self, numberOfElements):
+        """
+            Allocates an image array with shape (columns, rows, numberOfElements)
+            that can be passed as 'out' to the getters.
+        """
+        imageData = np.empty((numberOfElements, self._numberOfRows, self._numberOfColumns), dtype='<u2')
+        return np.transpose(imageData, [2, 1, 0])
+
+    def _receiveImage(self, command, numberOfElements, out):
+        if out is None:
+            out = self._frameBuffers.get(command)
+            if out is None:
+                out = self.createFrameBuffer(numberOfElements)
+                self._frameBuffers[command] = out
+
+        # recorded register writes have to take effect before the image
+        self._server.flushRegisters()
+        # the server sends the images row by row, which is the memory layout
+        # of the transposed array, so there is no decode phase
+        self._server.connection.query_into(command, np.transpose(out, [2, 1, 0]))
+        return out
+
+    def _streamImage(self, command, numberOfElements, video):
+        connection = self._server.connection
+        # two buffers: one is handed out while the other one is received
+        buffers = [self.createFrameBuffer(numberOfElements) for i in range(2)]
+
+        if video:
+            self._server.sendCommand('startVideo')
+        try:
+            self._server.flushRegisters()
+            connection.prefetch(command, np.transpose(buffers[0], [2, 1, 0]))
+            index = 0
+            while True:
+                connection.complete()
+                # register writes recorded meanwhile go before the next image
+                self._server.flushRegisters()
+                connection.prefetch(command, np.transpose(buffers[1 - index], [2, 1, 0]))
+                yield buffers[index]
+                index = 1 - index
+        finally:
+            # drop the answer of the last request, it is not needed anymore
+            connection.complete()
+            if video:
+                self._server.sendCommand('stopVideo')
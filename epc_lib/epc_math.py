@@ -5,19 +5,67 @@ Created on Sat Sep 28 10:24:57 2019
 Math library for the epc project to calculate amplitude and phase images from
 DCS-images as well as additional stuff.
 
+All functions accept a single frame as well as a stack of frames with a
+leading batch axis. convert_stack processes long recordings in chunks.
+
 @author: rjaco
 """
 
+from fractions import Fraction
+
 import numpy as np
 
 
+# values of the server for invalid pixels, the valid values are below
+FLAG_LOW_AMPLITUDE = 65300
+FLAG_SATURATION = 65400
+FLAG_ADC_OVERFLOW = 65500
+
+# codes of flag_mask
+VALID = 0
+LOW_AMPLITUDE = 1
+SATURATION = 2
+ADC_OVERFLOW = 3
+
+
+def flag_mask(image):
+    """
+    Find the invalid pixels of an image of the server in one pass.
+
+    Parameters
+    ----------
+    image : numpy array, shape (..., frames) or 2D
+        A DCS, distance or amplitude image. For several frames, e.g. the 4
+        DCS, a pixel is invalid if it is flagged in any frame.
+
+    Returns
+    -------
+    flags : numpy array, uint8
+        One code per pixel in the orientation of the image without the
+        frame axis: VALID, LOW_AMPLITUDE, SATURATION or ADC_OVERFLOW.
+
+    """
+    if image.ndim == 3:
+        image = np.maximum.reduce(image, axis=-1)
+
+    # the flag values are the only ones above FLAG_LOW_AMPLITUDE - 100, the
+    # few values below FLAG_LOW_AMPLITUDE count as low amplitude
+    invalid = image > FLAG_LOW_AMPLITUDE - 100
+    flags = invalid.view(np.uint8)
+    if invalid.any():
+        flags = flags.copy()
+        codes = (image[invalid] - (FLAG_LOW_AMPLITUDE - 100)) // 100
+        flags[invalid] = np.clip(codes, LOW_AMPLITUDE, ADC_OVERFLOW)
+    return flags
+
+
 def calc_dist_phase(dcs, led_mod_freq):
     """
     Calculate the amplite and phase image from the dcs
 
     Parameters
     ----------
-    dcs : numpy array, shape (height, width, 4)
+    dcs : numpy array, shape (height, width, 4) or (N, height, width, 4)
         A numpy array containing the 4 DCS-images
     led_mod_freq : int
         The LED modulation frequency in MHz.
@@ -35,11 +83,8 @@ def calc_dist_phase(dcs, led_mod_freq):
     distanceFactor = c / f_led / np.pi / 4
 
     dcsImages = []
-    for i in range(dcs.shape[2]):
-        dcsImages.append(dcs[:, :, i].astype(np.int32))
-    dist = np.array([]).astype(np.int32)
-
-    dist = np.array([]).astype(np.int32)
+    for i in range(dcs.shape[-1]):
+        dcsImages.append(dcs[..., i].astype(np.int32))
 
     diffD2D0 = (dcsImages[2] - dcsImages[0])
     diffD3D1 = (dcsImages[3] - dcsImages[1])
@@ -50,7 +95,7 @@ def calc_dist_phase(dcs, led_mod_freq):
     dist = distanceFactor * phase  # unit m
     dist *= 1000  # in mm
 
-    return dist.transpose(), phase.transpose()
+    return np.swapaxes(dist, -1, -2), np.swapaxes(phase, -1, -2)
 
 
 def calc_amplitude(dcs):
@@ -59,7 +104,7 @@ def calc_amplitude(dcs):
 
     Parameters
     ----------
-    dcs : numpy array, shape (height, width, 4)
+    dcs : numpy array, shape (height, width, 4) or (N, height, width, 4)
         A numpy array containing the 4 DCS-images
 
     Returns
@@ -70,10 +115,63 @@ def calc_amplitude(dcs):
     """
 
     dcs = dcs.astype(float)
-    ampl = 0.5 * np.sqrt((dcs[:, :, 3] - dcs[:, :, 1])**2 +
-                         (dcs[:, :, 2] - dcs[:, :, 0])**2)
+    ampl = 0.5 * np.sqrt((dcs[..., 3] - dcs[..., 1])**2 +
+                         (dcs[..., 2] - dcs[..., 0])**2)
+
+    return np.swapaxes(ampl, -1, -2)
 
-    return ampl.transpose()
+
+def calc_dist_phase_ampl(dcs, led_mod_freq, out=None):
+    """
+    Calculate the distance, phase and amplitude image from the dcs in one
+    pass in float32. The differences D2-D0 and D3-D1 are computed once and
+    the results are written into the output buffers without further
+    temporaries.
+
+    Parameters
+    ----------
+    dcs : numpy array, shape (width, height, 4) or (N, width, height, 4)
+        A numpy array containing the 4 DCS-images
+    led_mod_freq : int
+        The LED modulation frequency in MHz.
+    out : tuple of numpy arrays, optional
+        Three float32 arrays of shape (height, width), or (N, height, width)
+        for a stack, for distance, phase and amplitude. The default is None,
+        then new arrays are allocated.
+
+    Returns
+    -------
+    dist : numpy array
+        The distance image in milli meter.
+    phase : numpy array
+        The phase image in radians.
+    ampl : numpy array
+        Amplitude of the signal.
+
+    """
+    c = 3e8
+    f_led = led_mod_freq * 1E6
+    distanceFactor = c / f_led / np.pi / 4
+
+    if out is None:
+        shape = (3,) + dcs.shape[:-3] + (dcs.shape[-2], dcs.shape[-3])
+        out = np.empty(shape, dtype=np.float32)
+    dist, phase, ampl = out
+
+    # the transposed slices are contiguous for images from epc_image
+    d0, d1, d2, d3 = [np.swapaxes(dcs[..., i], -1, -2) for i in range(4)]
+    np.subtract(d2, d0, out=dist, dtype=np.float32)
+    np.subtract(d3, d1, out=ampl, dtype=np.float32)
+
+    np.arctan2(ampl, dist, out=phase)
+    phase += np.pi
+
+    np.hypot(ampl, dist, out=ampl)
+    ampl *= 0.5
+
+    np.multiply(phase, distanceFactor * 1000, out=dist)  # in mm
+
+    return dist, phase, ampl
 
 
 def check_signal_quality(ampl, gray, exposure):
@@ -83,7 +181,7 @@ def check_signal_quality(ampl, gray, exposure):
     Parameters
     ----------
     ampl : numpy array
-        Amplitude of the signal.
+        Amplitude of the signal, a single image or a stack of images.
     gray : numpy array
         Gray image.
     exposure: int
@@ -91,18 +189,19 @@ def check_signal_quality(ampl, gray, exposure):
 
     Returns
     -------
-    quality : int
-        Description of the signal strength.
+    quality : int or numpy array
+        Description of the signal strength, one value per image for a
+        stack.
         -1: underexposed signal
         0: good signal
         1: overexposed signal
-    noise : int
+    noise : int or numpy array
         Description of the SNR.
         -1: high noise
         0: good signal
     """
-    quality = 0
-    noise = 0
+    axes = (-2, -1)
+    size = ampl.shape[-2] * ampl.shape[-1]
 
     exp_ref = 100
     sensitivity_bw = 0.25
@@ -113,31 +212,31 @@ def check_signal_quality(ampl, gray, exposure):
 
     snr = 20 * np.log10(e_bw / e_tof)
 
-    tmp1 = (snr < 70).sum()
-    tmp2 = ampl.size - tmp1
+    tmp1 = (snr < 70).sum(axis=axes)
+    tmp2 = size - tmp1
 
-    if (tmp2 > tmp1):
-        quality = -1
+    quality = np.where(tmp2 > tmp1, -1, 0)
 
-    tmp1 = (ampl < 100).sum()
-    tmp2 = (ampl < 2000).sum() - tmp1
-    tmp3 = (2000 < ampl).sum()
+    tmp1 = (ampl < 100).sum(axis=axes)
+    tmp2 = (ampl < 2000).sum(axis=axes) - tmp1
+    tmp3 = (2000 < ampl).sum(axis=axes)
 
     # too many under exposed pixels
-    if (tmp1 > tmp2):
-        quality = -1
+    quality = np.where(tmp1 > tmp2, -1, quality)
     # too many overexposed pixels
-    elif(tmp3 > tmp2):
-        quality = 1
+    quality = np.where((tmp1 <= tmp2) & (tmp3 > tmp2), 1, quality)
 
     # if there are no underexposed pixels reduce exposure a bit
-    if (tmp1 < 1500):
-        quality = 1
+    quality = np.where(tmp1 < 1500, 1, quality)
+
+    noise = np.zeros_like(quality)
 
+    if quality.ndim == 0:
+        return int(quality), int(noise)
     return quality, noise
 
 
-def distance_correction(dist, error_polynom, dist_offset):
+def distance_correction(dist, error_polynom, dist_offset, out=None):
     """
     Correction of the systematic distance error by polynom error fit
 
@@ -147,6 +246,11 @@ def distance_correction(dist, error_polynom, dist_offset):
         The distance image.
     error_polynom : numpy array
         The error poylnom.
+    dist_offset : float
+        Constant distance offset in milli meter.
+    out : numpy array, optional
+        float32 array for the result, may be dist itself. The default is
+        None, then a new array is allocated.
 
     Returns
     -------
@@ -154,11 +258,280 @@ def distance_correction(dist, error_polynom, dist_offset):
         The error corrected distance image.
 
     """
-    dist = dist.astype('float32')
-
-    dist -= dist_offset
-    dist -= np.polyval(error_polynom, dist)
+    if out is None:
+        out = np.empty(dist.shape, dtype=np.float32)
+    dist = np.subtract(dist, dist_offset, dtype=np.float64)
+
+    # evaluate the polynom with the horner scheme in float64, in float32 the
+    # result deviates by up to 0.02 mm
+    error = np.full(dist.shape, error_polynom[0], dtype=np.float64)
+    for coeff in error_polynom[1:]:
+        error *= dist
+        error += coeff
+    np.subtract(dist, error, out=out, casting='same_kind')
 
     # print("Distance: "+ str(dist[30,60]))
 
-    return dist
+    return out
+
+
+# number of phase steps of the distance lookup tables
+LUT_SIZE = 65536
+
+# lookup tables by (led_mod_freq, dist_offset, error_polynom, size)
+_distance_luts = {}
+
+
+def distance_lut(led_mod_freq, error_polynom, dist_offset, size=LUT_SIZE):
+    """
+    Return the table mapping the quantized phase to the corrected distance,
+    i.e. calc_dist_phase_ampl followed by distance_correction in one
+    lookup. The tables are cached, so this is cheap to call every frame.
+
+    The phase 0..2pi is quantized into size steps. The error versus the
+    exact calculation is at most half a step times the slope of the
+    corrected distance. It is measured when the table is built, for the
+    config.ini polynom at 20 MHz and the default size it is about 1 mm at
+    the steep ends of the range and 0.1 mm where the polynom is flat.
+
+    Parameters
+    ----------
+    led_mod_freq : int
+        The LED modulation frequency in MHz.
+    error_polynom : numpy array
+        The error polynom.
+    dist_offset : float
+        Constant distance offset in milli meter.
+    size : int, optional
+        Number of phase steps. The default is LUT_SIZE.
+
+    Returns
+    -------
+    lut : numpy array, shape (size + 1,)
+        The corrected distance in milli meter for every phase step.
+    max_error : float
+        Maximum deviation from the exact calculation in milli meter.
+
+    """
+    key = (led_mod_freq, float(dist_offset),
+           tuple(float(c) for c in error_polynom), size)
+    entry = _distance_luts.get(key)
+    if entry is None:
+        c = 3e8
+        distanceFactor = c / (led_mod_freq * 1E6) / np.pi / 4 * 1000  # mm
+
+        # exact distance at the steps and in the middle between them
+        phase = np.linspace(0, 2 * np.pi, 2 * size + 1)
+        dist = phase * distanceFactor - dist_offset
+        exact = dist - np.polyval(error_polynom, dist)
+
+        lut = exact[::2].astype(np.float32)
+        max_error = float(np.max(np.abs(exact[1::2] - lut[:-1])))
+        entry = (lut, max_error)
+        _distance_luts[key] = entry
+    return entry
+
+
+def distance_from_phase(phase, lut, out=None):
+    """
+    Look up the corrected distance of a phase image in a table of
+    distance_lut.
+
+    Parameters
+    ----------
+    phase : numpy array
+        The phase image in radians, 0..2pi.
+    lut : numpy array
+        The table of distance_lut.
+    out : numpy array, optional
+        float32 array for the result. The default is None, then a new
+        array is allocated.
+
+    Returns
+    -------
+    dist : numpy array
+        The corrected distance image in milli meter.
+
+    """
+    # round to the nearest step, the phase is never negative
+    index = np.multiply(phase, (lut.size - 1) / (2 * np.pi),
+                        dtype=np.float32)
+    index += 0.5
+    return np.take(lut, index.astype(np.intp), out=out)
+
+
+# unambiguous range in milli meter of the modulation frequencies in MHz
+D_UNAMB = {20: 7500, 10: 15000, 5: 30000, 2.5: 60000, 1.25: 120000}
+
+# wrap count tables by (freq1, freq2)
+_wrap_luts = {}
+
+
+def wrap_count_lut(freq1, freq2):
+    """
+    Return the table of the wrap count of the freq1 phase for the dual
+    frequency unwrapping.
+
+    With the common base frequency f0 of both frequencies, freq1 = n1 * f0
+    and freq2 = n2 * f0, and the phases t1, t2 in turns, the integer
+    m = round(n2 * t1 - n1 * t2) = n1 * k2 - n2 * k1 identifies the wrap
+    counts k1, k2 by the chinese remainder theorem. The table holds k1 for
+    m = -n1 .. n2.
+
+    Parameters
+    ----------
+    freq1 : float
+        The higher modulation frequency in MHz.
+    freq2 : float
+        The lower modulation frequency in MHz.
+
+    Returns
+    -------
+    lut : numpy array, shape (n1 + n2 + 1,)
+        The wrap count k1 for m + n1.
+    n1 : int
+        Ratio of freq1 and the base frequency.
+    n2 : int
+        Ratio of freq2 and the base frequency.
+
+    """
+    key = (freq1, freq2)
+    entry = _wrap_luts.get(key)
+    if entry is None:
+        f1 = Fraction(str(freq1))
+        f2 = Fraction(str(freq2))
+        if f1 <= f2:
+            raise ValueError('freq1 must be higher than freq2')
+        # the base frequency is the greatest common divisor of both
+        f0 = Fraction(np.gcd(f1.numerator * f2.denominator,
+                             f2.numerator * f1.denominator),
+                      f1.denominator * f2.denominator)
+        n1, n2 = int(f1 / f0), int(f2 / f0)
+
+        m = np.arange(-n1, n2 + 1)
+        lut = (-m * pow(n2, -1, n1)) % n1 if n1 > 1 else 0 * m
+        entry = (lut.astype(np.float32), n1, n2)
+        _wrap_luts[key] = entry
+    return entry
+
+
+def unwrap_dual_frequency(phase1, freq1, phase2, freq2, out=None):
+    """
+    Calculate the distance from the phase images of two modulation
+    frequencies. The range is the unambiguous range of the base frequency
+    of both, e.g. 15 m for 20 and 10 MHz or 30 m for 20 and 15 MHz, while
+    the precision is the one of freq1.
+
+    Parameters
+    ----------
+    phase1 : numpy array
+        The phase image of freq1 in radians, 0..2pi.
+    freq1 : float
+        The higher modulation frequency in MHz.
+    phase2 : numpy array
+        The phase image of freq2 in radians, 0..2pi.
+    freq2 : float
+        The lower modulation frequency in MHz.
+    out : numpy array, optional
+        float32 array for the result. The default is None, then a new
+        array is allocated.
+
+    Returns
+    -------
+    dist : numpy array
+        The distance image in milli meter.
+
+    """
+    lut, n1, n2 = wrap_count_lut(freq1, freq2)
+    c = 3e8
+    distanceFactor = c / (freq1 * 1E6) / np.pi / 4 * 1000  # mm
+
+    # m = round(n2 * t1 - n1 * t2), shifted to the table index
+    index = np.multiply(phase1, n2 / (2 * np.pi), dtype=np.float32)
+    index -= np.multiply(phase2, n1 / (2 * np.pi), dtype=np.float32)
+    index += n1 + 0.5
+    np.floor(index, out=index)
+    wraps = np.take(lut, index.astype(np.intp))
+
+    # dist = (phase1 + 2pi * k1) * distanceFactor
+    wraps *= 2 * np.pi
+    wraps += phase1
+    return np.multiply(wraps, distanceFactor, out=out, dtype=np.float32)
+
+
+def calc_dist_dual_frequency(dcs1, freq1, dcs2, freq2, out=None):
+    """
+    Calculate the extended range distance image from the DCS images of two
+    modulation frequencies, see unwrap_dual_frequency.
+
+    Parameters
+    ----------
+    dcs1 : numpy array, shape (width, height, 4)
+        The DCS images at freq1.
+    freq1 : float
+        The higher modulation frequency in MHz.
+    dcs2 : numpy array, shape (width, height, 4)
+        The DCS images at freq2.
+    freq2 : float
+        The lower modulation frequency in MHz.
+    out : numpy array, optional
+        float32 array for the result. The default is None.
+
+    Returns
+    -------
+    dist : numpy array
+        The distance image in milli meter.
+    ampl : numpy array
+        Amplitude of the signal at freq1.
+
+    """
+    _, phase1, ampl = calc_dist_phase_ampl(dcs1, freq1)
+    _, phase2, _ = calc_dist_phase_ampl(dcs2, freq2)
+    return unwrap_dual_frequency(phase1, freq1, phase2, freq2, out=out), ampl
+
+
+def convert_stack(dcs, led_mod_freq, error_polynom=None, dist_offset=0,
+                  chunk_size=256):
+    """
+    Convert a stack of DCS frames into distance, phase and amplitude images
+    in chunks, so the temporary memory stays bounded for long recordings.
+
+    Parameters
+    ----------
+    dcs : numpy array, shape (N, width, height, 4)
+        The DCS frames. A recording of live_viewer.py with shape
+        (width, height, 4, N) fits after np.moveaxis(data, -1, 0).
+    led_mod_freq : int
+        The LED modulation frequency in MHz.
+    error_polynom : numpy array, optional
+        The error polynom of the distance correction. The default is None,
+        then the distance is not corrected.
+    dist_offset : float, optional
+        Constant distance offset in milli meter for the correction. The
+        default is 0.
+    chunk_size : int, optional
+        Number of frames processed at once. The default is 256.
+
+    Returns
+    -------
+    dist : numpy array, shape (N, height, width)
+        The distance images in milli meter.
+    phase : numpy array, shape (N, height, width)
+        The phase images in radians.
+    ampl : numpy array, shape (N, height, width)
+        Amplitude of the signal.
+
+    """
+    n_frames = dcs.shape[0]
+    out = np.empty((3, n_frames, dcs.shape[2], dcs.shape[1]),
+                   dtype=np.float32)
+
+    for start in range(0, n_frames, chunk_size):
+        stop = min(start + chunk_size, n_frames)
+        dist, phase, ampl = calc_dist_phase_ampl(dcs[start:stop], led_mod_freq,
+                                                 out=out[:, start:stop])
+        if error_polynom is not None:
+            lut, _ = distance_lut(led_mod_freq, error_polynom, dist_offset)
+            distance_from_phase(phase, lut, out=dist)
+
+    return out[0], out[1], out[2]
@@ -15,16 +15,68 @@ import socket
 import array
 import numpy as np
 
+from epc_lib.epc_connection import get_connection
+from epc_lib.epc_settings import epc_settings
+
 
 class epc_server:
 
-    def __init__(self, serverIP="192.168.7.2", serverPort=50660):
+    # commands that do not change any register
+    _READ_COMMANDS = ('r', 'dumpAllRegisters', 'getTemperature', 'getDCSSorted',
+                      'getDistanceAndAmplitudeSorted', 'getDistanceSorted',
+                      'getAmplitudeSorted')
+
+    # commands that answer with a 16 bit status
+    _STATUS_COMMANDS = ('w', 'setIntegrationTime2D', 'setIntegrationTime3D',
+                        'setModulationFrequency', 'enableSaturation',
+                        'enableAdcOverflow', 'correctTemperature',
+                        'correctAmbientLight', 'correctDRNU', 'loadConfig',
+                        'startVideo', 'stopVideo', 'setROI')
+
+    @staticmethod
+    def replyLength(command):
+        """
+            Returns the length in bytes of the answer to 'command', or None if
+            it is not known, e.g. for the image commands, whose length depends
+            on the image size.
+        """
+        args = command.split()
+        if args[0] in epc_server._STATUS_COMMANDS:
+            return 2
+        elif args[0] == 'r':
+            # 16 bit per register
+            try:
+                return 2*int(args[2])
+            except (IndexError, ValueError):
+                return 2
+        elif args[0] == 'getTemperature':
+            return 2
+        elif args[0] == 'dumpAllRegisters':
+            return 0x100*2
+        return None
+
+    def __init__(self, serverIP="192.168.7.2", serverPort=50660, timeout=None):
+        """
+            'timeout' limits every request in seconds, a camera that does not
+            answer raises socket.timeout instead of blocking forever. The
+            default is None (blocking).
+        """
         self.IP   = serverIP
         self.port = serverPort
         self._N_REGS = 0x100
 
+        # register shadow: values of the last dump and not yet written values
+        self._registerShadow = None
+        self._pendingRegisters = {}
+
         self.checkConnection()
 
+        # persistent connection shared with epc_image
+        self.connection = get_connection(self.IP, self.port, timeout)
+
+        # last applied camera settings
+        self.settings = epc_settings(self)
+
 
     def checkConnection(self):
         try:
@@ -34,18 +86,27 @@ class epc_server:
             sys.exit("ERROR: Connection could not be established. Please check IP and network connection and make sure that a suitable server is running.")
         print("INFO: Connection to server successfully established.")
 
+    def closeConnection(self):
+        """
+            Closes the persistent connection. It is re-opened automatically
+            by the next command.
+        """
+        self.connection.close()
+
+
     def sendCommand(self, command):
-        s = socket.create_connection((self.IP, self.port))
-        command += "\n"  # support for C++ server
-        s.send(command.encode())
-        resp = s.recv(100)
-        resp_len = len(resp)
+        self.flushRegisters()
+        self._trackRegisters(command)
+        n_bytes = self.replyLength(command)
+        if n_bytes is None:
+            resp = self.connection.query_any(command, 100)
+        else:
+            resp = self.connection.query(command, n_bytes)
         ints = array.array('h', resp)
-        s.close()
         if len(ints) == 1 and ints[0] == -1:
-            sys.exit("ERROR: Server command '" + command[:-1] + "' failed.")
+            sys.exit("ERROR: Server command '" + command + "' failed.")
         else:
-            print('INFO: Server command \'' + command[:-1] + '\' executed.')
+            print('INFO: Server command \'' + command + '\' executed.')
         return ints
 
 
@@ -61,23 +122,60 @@ class epc_server:
             self.sendCommand(command)
 
 
+    def sendCommandBatch(self, commandList):
+        """
+            Sends a list of commands in the given order with as few round
+            trips as possible. All commands with an answer of known length,
+            see replyLength, e.g. the setters and the register writes 'w',
+            are sent together in one round trip. Commands with an answer of
+            unknown length are sent one by one by sendCommand().
+            Returns the answers like sendCommand(), one per command.
+            Example: sendCommandBatch(['setIntegrationTime2D 500',
+                                       'setIntegrationTime3D 500'])
+        """
+        if not commandList:
+            return []
+        self.flushRegisters()
+        answers = []
+        batch = []
+        for command in commandList:
+            if self.replyLength(command) is None:
+                answers += self._sendBatch(batch)
+                batch = []
+                answers.append(self.sendCommand(command))
+            else:
+                batch.append(command)
+        answers += self._sendBatch(batch)
+        print('INFO: Server commands \'' + '\', \''.join(commandList) + '\' executed.')
+        return answers
+
+
+    def _sendBatch(self, commandList):
+        """
+            Sends commands with answers of known length in one round trip.
+        """
+        if not commandList:
+            return []
+        for command in commandList:
+            self._trackRegisters(command)
+        resps = self.connection.query_batch(commandList,
+                                            [self.replyLength(command) for command in commandList])
+        answers = [array.array('h', resp) for resp in resps]
+        for command, ints in zip(commandList, answers):
+            if len(ints) == 1 and ints[0] == -1:
+                sys.exit("ERROR: Server command '" + command + "' failed.")
+        return answers
+
+
     def i2c(self, arguments):
-        arguments += "\n"  # support for C++ server
+        self.flushRegisters()
         if arguments[0]=='w':
-            s = socket.create_connection((self.IP, self.port))
-            s.send(arguments)
-            s.recv(4) # wait for response from server
-            s.close()
+            self._trackRegisters(arguments)
+            self.connection.query(arguments, self.replyLength(arguments)) # wait for response from server
             return 0
         elif arguments[0]=='r':
-            s = socket.create_connection((self.IP, self.port))
-            s.send(arguments)
-            try:
-                n_bytes = 4*int(arguments.split(' ')[2])
-            except:
-                n_bytes = 4
-            bytes = array.array('h',s.recv(n_bytes))
-            s.close()
+            n_bytes = self.replyLength(arguments)
+            bytes = array.array('h', self.connection.query(arguments, n_bytes))
             return bytes
         else:
             sys.exit("ERROR: Invalid i2c command '" + arguments + "'")
@@ -85,22 +183,80 @@ class epc_server:
 
 
     def getRegisterDump(self):
-        s = socket.create_connection((self.IP, self.port))
-        s.send("dumpAllRegisters\n")
-        registerDump = np.frombuffer(s.recv(self._N_REGS*2), dtype="h") # 256 * 2 bytes = 512 bytes
-        s.close()
+        self.flushRegisters()
+        resp = self.connection.query("dumpAllRegisters", self._N_REGS*2)
+        registerDump = np.frombuffer(resp, dtype="h") # 256 * 2 bytes = 512 bytes
         return registerDump
 
 
-    def readRegister(self, address):
+    def syncRegisters(self):
+        """
+            Fills the register shadow with one dump of all registers.
+        """
+        self._registerShadow = self.getRegisterDump().copy()
+
+
+    def invalidateRegisters(self):
+        """
+            Drops the register shadow, e.g. after the server changed registers
+            on its own. The next read fetches a new dump.
+        """
+        self._registerShadow = None
+
+
+    def readRegister(self, address, cached=False):
         """
             Returns register value from the register addressed by 'address'.
+            With 'cached' the value comes from the register shadow, which is
+            filled by one register dump if needed. Only use it for registers
+            that the camera does not change on its own, status registers are
+            read from the camera.
         """
-        return self.i2c("r %02X" %(address))[0]
+        if not cached:
+            return self.i2c("r %02X" %(address))[0]
+        if address in self._pendingRegisters:
+            return self._pendingRegisters[address]
+        if self._registerShadow is None:
+            self.syncRegisters()
+        return int(self._registerShadow[address])
 
 
-    def writeRegister(self, address, value):
+    def writeRegister(self, address, value, flush=True):
         """
             Writes register value 'value' to the register addressed by 'address'.
+            Without 'flush' the write is only recorded and sent by the next
+            flushRegisters() together with the other recorded writes. Later
+            writes to the same register replace earlier ones. Every other
+            command and image read flushes the recorded writes first.
+        """
+        self._pendingRegisters[address] = value
+        if flush:
+            self.flushRegisters()
+
+
+    def flushRegisters(self):
+        """
+            Sends all recorded register writes in one round trip, see
+            sendCommandBatch. Writes of values the register shadow already
+            holds are skipped.
+        """
+        if not self._pendingRegisters:
+            return
+        pending, self._pendingRegisters = self._pendingRegisters, {}
+        commandList = ["w %02X %02X" %(address, value) for address, value in pending.items()
+                       if self._registerShadow is None or self._registerShadow[address] != value]
+        self.sendCommandBatch(commandList)
+
+
+    def _trackRegisters(self, command):
+        """
+            Keeps the register shadow up to date for the given command.
         """
-        self.i2c("w %02X %02X" %(address, value))
+        if self._registerShadow is None:
+            return
+        args = command.split()
+        if args[0] == 'w' and len(args) == 3:
+            self._registerShadow[int(args[1], 16)] = int(args[2], 16)
+        elif args[0] not in self._READ_COMMANDS:
+            # all other commands may change registers, e.g. loadConfig
+            self.invalidateRegisters()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration session of the camera. It remembers the last applied value
+of every setting and sends only the changed ones, with as few round trips
+as possible.
+"""
+
+
+class epc_settings:
+    """
+    Settings are server commands with one argument, e.g.
+    'setIntegrationTime3D 1000' is the setting 'setIntegrationTime3D' with
+    the value 1000. Register writes like 'w 11 fa' fit as well, with the
+    setting 'w 11' and the value 'fa'. Actions like 'loadConfig 1' are no
+    settings, they are sent by every apply() they are set for.
+
+        settings.set('setIntegrationTime2D', 500)
+        settings.set('setIntegrationTime3D', 500)
+        settings.apply()
+    """
+
+    # commands that do something on every call instead of keeping a value
+    ACTIONS = ('loadConfig', 'startVideo', 'stopVideo')
+
+    def __init__(self, server):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        server : epc_server
+            The server the settings are sent to.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._server = server
+        self._applied = {}
+        self._pending = {}
+
+    def set(self, name, value):
+        """
+        Request a new value of a setting. It is sent by apply(), if it
+        differs from the last applied value.
+
+        Parameters
+        ----------
+        name : str
+            The command of the setting.
+        value : int or str
+            The new value.
+
+        Returns
+        -------
+        None.
+
+        """
+        value = str(value)
+        if name not in self.ACTIONS and self._applied.get(name) == value:
+            self._pending.pop(name, None)
+        else:
+            self._pending[name] = value
+
+    def get(self, name):
+        """
+        Return the last applied value of a setting or None if unknown.
+
+        Parameters
+        ----------
+        name : str
+            The command of the setting.
+
+        Returns
+        -------
+        value : str
+            The last applied value.
+
+        """
+        return self._applied.get(name)
+
+    def apply(self):
+        """
+        Send all changed settings in one round trip, in the order they
+        were set first.
+
+        Returns
+        -------
+        n_changed : int
+            The number of sent settings.
+
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        commands = [name + ' ' + value for name, value in pending.items()]
+        self._server.sendCommandBatch(commands)
+        self._applied.update((name, value) for name, value in pending.items()
+                             if name not in self.ACTIONS)
+        return len(commands)
+
+    def invalidate(self, name=None):
+        """
+        Forget the applied value of a setting, or of all settings, e.g.
+        after the camera was restarted. The next set() sends it again.
+
+        Parameters
+        ----------
+        name : str, optional
+            The command of the setting. The default is None (all).
+
+        Returns
+        -------
+        None.
+
+        """
+        if name is None:
+            self._applied.clear()
+        else:
+            self._applied.pop(name, None)
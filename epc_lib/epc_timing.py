@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Low overhead timing of the phases of the server requests (connect, send,
+first byte, payload, decode), kept as rolling statistics per command.
+"""
+
+import time
+
+import numpy as np
+
+
+# phases of a request in the order they happen
+PHASES = ('connect', 'send', 'first_byte', 'payload', 'decode')
+
+
+class epc_timing:
+    """
+    Rolling window of the last durations of every (command, phase). A
+    record is one array store, so the timing can stay on in production.
+    With enabled = False nothing is measured at all.
+    """
+
+    def __init__(self, window=1000, enabled=True):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        window : int, optional
+            Number of durations kept per command and phase. The default is
+            1000.
+        enabled : bool, optional
+            Measure the durations. The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.enabled = enabled
+        self._window = window
+        self._buffers = {}
+        self._counts = {}
+
+    def start(self):
+        """
+        Return the start time of a phase, None if the timing is disabled.
+        """
+        if self.enabled:
+            return time.perf_counter()
+        return None
+
+    def mark(self, command, phase, start):
+        """
+        Record the phase of command that began at start and return the
+        start time of the next phase.
+
+        Parameters
+        ----------
+        command : str
+            The command.
+        phase : str
+            The phase that ends now, one of PHASES.
+        start : float
+            The start time of the phase from start() or mark().
+
+        Returns
+        -------
+        now : float
+            The current time, None if the timing is disabled.
+
+        """
+        if start is None:
+            return None
+        now = time.perf_counter()
+        self.record(command, phase, now - start)
+        return now
+
+    def record(self, command, phase, duration):
+        """
+        Record the duration of a phase.
+
+        Parameters
+        ----------
+        command : str
+            The command, only the first word is used.
+        phase : str
+            The phase, one of PHASES.
+        duration : float
+            The duration in seconds.
+
+        Returns
+        -------
+        None.
+
+        """
+        key = (command.split(None, 1)[0], phase)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = np.zeros(self._window)
+            self._buffers[key] = buffer
+            self._counts[key] = 0
+        count = self._counts[key]
+        buffer[count % self._window] = duration
+        self._counts[key] = count + 1
+
+    def reset(self):
+        """
+        Drop all recorded durations.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._buffers = {}
+        self._counts = {}
+
+    def statistics(self):
+        """
+        Calculate the statistics of the recorded durations.
+
+        Returns
+        -------
+        stats : dict
+            stats[command][phase] is a dict with count, mean, p50, p95, p99
+            and max in milli seconds of the last window of durations.
+
+        """
+        stats = {}
+        for (command, phase), buffer in list(self._buffers.items()):
+            count = self._counts[(command, phase)]
+            values = buffer[:min(count, self._window)] * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stats.setdefault(command, {})[phase] = {
+                'count': count, 'mean': values.mean(), 'p50': p50,
+                'p95': p95, 'p99': p99, 'max': values.max()}
+        return stats
+
+    def summary(self):
+        """
+        Return the statistics as readable table.
+
+        Returns
+        -------
+        text : str
+            One line per command and phase.
+
+        """
+        lines = []
+        for command, phases in self.statistics().items():
+            for phase in PHASES:
+                if phase in phases:
+                    lines.append('{:32s} {:10s} n={count:<7d} mean={mean:7.3f} '
+                                 'p50={p50:7.3f} p95={p95:7.3f} p99={p99:7.3f} '
+                                 'max={max:7.3f} ms'.format(command, phase,
+                                                            **phases[phase]))
+        return '\n'.join(lines)
@@ -6,9 +6,39 @@ def imagerInit(server, imgDev):
 	enableCompensations	 =   1   #1 for compensated DATA
 	setModulation			=	1	#1 for enabling own modulation configuration (not the GUI configurations)
 
+	# all settings are sent together in one round trip, only if changed
+	settings = server.settings
+
 	if fullROI:
-		server.sendCommand('w 11 fa')
-		icType=server.sendCommand('r 12')
+		settings.set('w 11', 'fa')
+
+	settings.set('enableSaturation', 1)		# 1 = enable saturation	 flag value = 65400
+	settings.set('enableAdcOverflow', 1)	   # 1 = enable ADC overflow   flag value = 65500
+
+	#set modulation frequency and integration times if needed
+	if setModulation:							  	#set mod frequency and integration times if needed
+		#set mod frequency
+		modFreq={'20_24MHz':0,'10_12MHz':1}
+		setModFreq = '20_24MHz'
+		settings.set('setModulationFrequency', modFreq[setModFreq])
+		#set integration times
+		settings.set('setIntegrationTime2D', 1000)	 # t_int in us
+		settings.set('setIntegrationTime3D', 1000)	  # t_int in us
+
+	#enable compensations if needed
+	if enableCompensations:
+		settings.set('correctTemperature', 1)	  # 1 = enable temperature correction
+		settings.set('correctAmbientLight', 1)	 # 1 = enable ambient light correction
+		settings.set('correctDRNU', 2)			 # 2 = enable DRNU correction
+	else:
+		settings.set('correctTemperature', 0)	  # 1 = enable temperature correction
+		settings.set('correctAmbientLight', 0)	 # 1 = enable ambient light correction
+		settings.set('correctDRNU', 0)			 # 1 = enable DRNU correction
+
+	settings.set('loadConfig', 1)				  # loadConfig 1 = TOF mode (3D imaging)
+	settings.apply()
+
+	icType=server.sendCommand('r 12')
 	if (icType[0]==2):
 		numberOfRows		= 240
 		numberOfColumns	 = 320
@@ -32,34 +62,4 @@ def imagerInit(server, imgDev):
 	imgDev.setNumberOfRecordedImageDataFrames(numberOf3DimageDataframe);
 	imgDev.updateNbrRecordedBytes()
 
-	#####################################################################################
-	# measurement																	   #
-	#####################################################################################
-
-	server.sendCommand('enableSaturation 1')		# 1 = enable saturation	 flag value = 65400
-	server.sendCommand('enableAdcOverflow 1')	   # 1 = enable ADC overflow   flag value = 65500
-
-	#set modulation frequency and integration times if needed
-	if setModulation:							  	#set mod frequency and integration times if needed
-		#set mod frequency
-		modFreq={'20_24MHz':0,'10_12MHz':1}
-		setModFreq = '20_24MHz'
-		server.sendCommand('setModulationFrequency '+str(modFreq[setModFreq]))
-		#set integration times
-		server.sendCommand('setIntegrationTime2D 1000')	 # t_int in us
-		server.sendCommand('setIntegrationTime3D 1000')	  # t_int in us
-
-	#enable compensations if needed
-	if enableCompensations:
-		server.sendCommand('correctTemperature 1')	  # 1 = enable temperature correction
-		server.sendCommand('correctAmbientLight 1')	 # 1 = enable ambient light correction
-		server.sendCommand('correctDRNU 2')			 # 2 = enable DRNU correction
-	else:
-		server.sendCommand('correctTemperature 0')	  # 1 = enable temperature correction
-		server.sendCommand('correctAmbientLight 0')	 # 1 = enable ambient light correction
-		server.sendCommand('correctDRNU 0')			 # 1 = enable DRNU correction
-
-	server.sendCommand('loadConfig 1')				  # loadConfig 1 = TOF mode (3D imaging)
-
-# 	server.sendCommand('startVideo')	 				# increases the fps, but only usable if you don't record the temperature, too
-
+	# video mode increases the fps, it is started by epc_image.streamDCSs/streamDistAmpl
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Background models of the distance images. Every update costs the same,
+independent of the length of the window. Background keeps the data derived
+from a background until it changes.
+"""
+
+import numpy as np
+
+
+class Background:
+    """
+    A background image with cached derived data. The version counts the
+    changes of the image, the cached values are computed again only after
+    a change:
+
+        background.set(image)          # a new image
+        background.touch()             # the image was changed in place
+        background.cached('name', function)
+    """
+
+    def __init__(self, image, threshold):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        image : numpy array
+            The background image. It is used without copy, call touch()
+            after changing it in place.
+        threshold : float
+            Objects are closer than the background by more than threshold.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.image = image
+        self.threshold = threshold
+        self.version = 0
+        self._cache = {}
+
+    def set(self, image):
+        """
+        Replace the background image.
+
+        Parameters
+        ----------
+        image : numpy array
+            The new background image, float32.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.image = np.asarray(image, dtype=np.float32)
+        self.version += 1
+
+    def touch(self):
+        """
+        Mark the image as changed.
+        """
+        self.version += 1
+
+    def cached(self, name, function):
+        """
+        Return function(image), computed only once per version.
+
+        Parameters
+        ----------
+        name : str
+            Name of the derived data.
+        function : callable
+            Calculates the derived data from the image.
+
+        Returns
+        -------
+        value : object
+            The derived data.
+
+        """
+        entry = self._cache.get(name)
+        if entry is None or entry[0] != self.version:
+            entry = (self.version, function(self.image))
+            self._cache[name] = entry
+        return entry[1]
+
+    @property
+    def base_height(self):
+        """
+        Median of the background, the distance of the floor.
+        """
+        return self.cached('base_height', np.median)
+
+    @property
+    def threshold_map(self):
+        """
+        Distance below which a pixel belongs to an object.
+        """
+        return self.cached('threshold_map', lambda image: np.subtract(
+            image, self.threshold, dtype=np.float32))
+
+
+class BackgroundModel:
+    """
+    Background of the distance images, updated with every frame.
+
+    'mean':   mean of the last length frames, by a running sum over a ring
+              of preallocated frames
+    'ema':    exponential moving average with the weight alpha
+    'median': approximate running median, the background moves step milli
+              meter towards every frame
+    """
+
+    METHODS = ('mean', 'ema', 'median')
+
+    def __init__(self, height, width, length=200, method='mean', alpha=None,
+                 step=5.0):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        height : int
+            Number of rows of the images.
+        width : int
+            Number of columns of the images.
+        length : int, optional
+            Number of frames of the mean. The default is 200.
+        method : str, optional
+            'mean', 'ema' or 'median'. The default is 'mean'.
+        alpha : float, optional
+            Weight of a new frame for 'ema'. The default is None, then
+            2 / (length + 1) is used, which averages about as long as the
+            mean.
+        step : float, optional
+            Change of the background per frame in milli meter for
+            'median'. The default is 5.0.
+
+        Returns
+        -------
+        None.
+
+        """
+        if method not in self.METHODS:
+            raise ValueError('Unknown background model ' + str(method))
+        self.method = method
+        self.length = length
+        self.alpha = 2 / (length + 1) if alpha is None else alpha
+        self.step = step
+
+        self.background = np.zeros((height, width), dtype=np.float32)
+        if method == 'mean':
+            self._ring = np.zeros((length, height, width), dtype=np.float32)
+            # the sum is kept in float64, so it does not drift
+            self._sum = np.zeros((height, width))
+        self._tmp = np.empty((height, width), dtype=np.float32)
+        self.count = 0
+
+    def reset(self):
+        """
+        Forget all frames.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.count = 0
+
+    def update(self, image):
+        """
+        Put a frame into the model.
+
+        Parameters
+        ----------
+        image : numpy array
+            The distance image.
+
+        Returns
+        -------
+        background : numpy array
+            The current background, float32. It is updated in place by the
+            next call, copy it to keep it.
+
+        """
+        if self.count == 0:
+            # start with the first frame
+            self.background[:] = image
+            if self.method == 'mean':
+                self._sum[:] = 0
+        if self.method == 'mean':
+            self._update_mean(image)
+        elif self.method == 'ema':
+            # background += alpha * (image - background)
+            np.subtract(image, self.background, out=self._tmp)
+            self._tmp *= self.alpha
+            self.background += self._tmp
+        else:
+            # background += step * sign(image - background)
+            np.subtract(image, self.background, out=self._tmp)
+            np.sign(self._tmp, out=self._tmp)
+            self._tmp *= self.step
+            self.background += self._tmp
+        self.count += 1
+        return self.background
+
+    def _update_mean(self, image):
+        """
+        Replace the oldest frame of the ring and update the sum.
+        """
+        slot = self._ring[self.count % self.length]
+        if self.count >= self.length:
+            self._sum -= slot
+        slot[:] = image
+        self._sum += slot
+        n = min(self.count + 1, self.length)
+        np.divide(self._sum, n, out=self.background, casting='unsafe')
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Noise suppression of the distance images, on the uint16 or float32 data
+without conversion to 8 bit. OpenCV has the median of float32 and uint16
+images only for the kernel sizes 3 and 5, larger kernels are approximated
+by a cascade of these.
+
+Run the module for the time per frame of all filters:
+    python -m imgProc.denoise
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+
+class Denoiser:
+    """
+    Denoising stage with a fixed filter and preallocated temporary images.
+
+    'median':    median, exact for ksize 3 and 5, a cascade of 5x5 and 3x3
+                 medians with the same support for larger ksize
+    'bilateral': bilateral filter, keeps the edges between objects and the
+                 floor; sigma is the distance difference in milli meter
+                 that is still smoothed
+    'amplitude': mean over ksize x ksize weighted by the amplitude, noisy
+                 dark pixels count less
+    'none':      no filter
+    """
+
+    FILTERS = ('median', 'bilateral', 'amplitude', 'none')
+
+    def __init__(self, height, width, method='median', ksize=5, sigma=50.0):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        height : int
+            Number of rows of the images.
+        width : int
+            Number of columns of the images.
+        method : str, optional
+            One of FILTERS. The default is 'median'.
+        ksize : int, optional
+            Odd size of the filter kernel. The default is 5.
+        sigma : float, optional
+            Distance difference in milli meter for 'bilateral'. The default
+            is 50.0.
+
+        Returns
+        -------
+        None.
+
+        """
+        if method not in self.FILTERS:
+            raise ValueError('Unknown filter ' + str(method))
+        if ksize % 2 != 1:
+            raise ValueError('ksize must be odd')
+        self.method = method
+        self.ksize = ksize
+        self.sigma = sigma
+
+        # kernel sizes of the median cascade, their radii add up to ksize
+        radius = ksize // 2
+        self._median_sizes = [5] * (radius // 2) + [3] * (radius % 2)
+
+        shape = (height, width)
+        self._float = np.empty(shape, dtype=np.float32)
+        self._weighted = np.empty(shape, dtype=np.float32)
+        self._weights = np.empty(shape, dtype=np.float32)
+
+    def apply(self, image, ampl=None, out=None):
+        """
+        Filter a distance image.
+
+        Parameters
+        ----------
+        image : numpy array, uint16 or float32
+            The distance image.
+        ampl : numpy array, optional
+            The amplitude image, required for 'amplitude'.
+        out : numpy array, optional
+            Array of the shape and type of image for the result. The
+            default is None, then a new array is allocated.
+
+        Returns
+        -------
+        image : numpy array
+            The filtered image.
+
+        """
+        if out is None:
+            out = np.empty_like(image)
+
+        if self.method == 'median':
+            src = image
+            for ksize in self._median_sizes:
+                cv2.medianBlur(src, ksize, dst=out)
+                src = out
+            if src is image:
+                out[:] = image
+        elif self.method == 'bilateral':
+            # OpenCV filters 8 bit and float32 images only
+            src = image
+            if image.dtype != np.float32:
+                src = self._float
+                src[:] = image
+            cv2.bilateralFilter(src, self.ksize, self.sigma, self.ksize / 2,
+                                dst=self._weighted)
+            np.copyto(out, self._weighted, casting='unsafe')
+        elif self.method == 'amplitude':
+            # sum(ampl * dist) / sum(ampl) over the kernel
+            size = (self.ksize, self.ksize)
+            np.multiply(image, ampl, out=self._float, casting='unsafe')
+            cv2.boxFilter(self._float, -1, size, dst=self._weighted,
+                          normalize=False)
+            np.copyto(self._float, ampl, casting='unsafe')
+            cv2.boxFilter(self._float, -1, size, dst=self._weights,
+                          normalize=False)
+            self._weights += 1e-3  # avoid zero by a ~0
+            np.divide(self._weighted, self._weights, out=self._weighted)
+            np.copyto(out, self._weighted, casting='unsafe')
+        else:
+            out[:] = image
+        return out
+
+
+def benchmark(sizes=((60, 160), (240, 320)), ksize=7, repeats=200):
+    """
+    Print the time per frame of all filters.
+
+    Parameters
+    ----------
+    sizes : list of tuples, optional
+        The image sizes (height, width). The default is 160x60 and 320x240.
+    ksize : int, optional
+        The kernel size. The default is 7.
+    repeats : int, optional
+        Number of measured frames. The default is 200.
+
+    Returns
+    -------
+    results : dict
+        Time per frame in milli seconds by (size, dtype, filter).
+
+    """
+    rng = np.random.default_rng(0)
+    results = {}
+    for height, width in sizes:
+        dist = rng.normal(2500, 30, (height, width))
+        ampl = rng.uniform(100, 2000, (height, width)).astype(np.float32)
+        for dtype in (np.uint16, np.float32):
+            image = dist.astype(dtype)
+            out = np.empty_like(image)
+            for method in Denoiser.FILTERS:
+                denoiser = Denoiser(height, width, method, ksize)
+                denoiser.apply(image, ampl, out)
+                start = time.perf_counter()
+                for i in range(repeats):
+                    denoiser.apply(image, ampl, out)
+                t = (time.perf_counter() - start) / repeats * 1000
+                results[((width, height), np.dtype(dtype).name, method)] = t
+                print('{}x{} {:8s} {:10s} {:.3f} ms'.format(
+                    width, height, np.dtype(dtype).name, method, t))
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()
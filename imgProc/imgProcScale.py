@@ -10,11 +10,189 @@ Module containing the image processing algorithms
 import cv2
 import numpy as np
 
+from epc_lib import epc_backend, epc_math
 
-def scale_image_rgb(img, autoScale=True, colorMap=True):
+
+# colors of the invalid pixels by flag code, see epc_math.flag_mask
+FLAG_COLORS = np.array([[0, 0, 0],
+                        [255, 0, 0],    # low amplitude: blue
+                        [0, 255, 0],    # saturation: green
+                        [0, 0, 255],    # ADC overflow: red
+                        [64, 64, 64]],  # outside of the ROI mask: gray
+                       dtype=np.uint8)
+
+
+class DisplayRenderer:
+    """
+    Renders uint16 images of the server for the display with one lookup in
+    a table of 65536 colors, which contains the scaling, the colormap and
+    the colors of the flag values. The result is written into preallocated
+    buffers and upscaled by nearest neighbour.
+
+        renderer = DisplayRenderer(scale=4)
+        bgr = renderer.render(dist)
+    """
+
+    # hysteresis of autoScale, fraction of the range, at least 16 values
+    RANGE_MARGIN = 1 / 32
+
+    def __init__(self, scale=4, autoScale=True, colorMap=True, rotate=True,
+                 rgb=False, value_range=(0, 4096), buffers=2):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        scale : int, optional
+            Integer upscaling factor. The default is 4.
+        autoScale : bool, optional
+            Scale the range of the valid values of every image to the
+            colors. The table is only built again when the minimum or the
+            maximum moved by more than RANGE_MARGIN of the range, at least
+            by 16, so the noise of the extreme values does not rebuild it
+            every frame. The default is True.
+        colorMap : bool, optional
+            Use the jet colormap instead of a gray scale. The default is
+            True.
+        rotate : bool, optional
+            Rotate the image 90 degrees counterclockwise, for images in the
+            (columns, rows) layout of epc_image. The default is True.
+        rgb : bool, optional
+            Channel order RGB for Qt instead of BGR for OpenCV. The default
+            is False.
+        value_range : tuple, optional
+            Values mapped to the first and last color without autoScale.
+            The default is (0, 4096), the 12 bits of the sensor.
+        buffers : int, optional
+            Number of output buffers used in turn, so a returned image stays
+            valid while the next ones are rendered. The default is 2.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.scale = scale
+        self.autoScale = autoScale
+        self.colorMap = colorMap
+        self.rotate = rotate
+        self.rgb = rgb
+        self.buffers = buffers
+
+        self._range = None
+        self._lut = None
+        self._shape = None
+        self._u16 = None
+        self._index = 0
+        self._set_range(*value_range)
+
+    def _set_range(self, minpx, maxpx):
+        """
+        Build the color table for the values minpx..maxpx.
+        """
+        if self._range == (minpx, maxpx):
+            return
+        self._range = (minpx, maxpx)
+
+        values = np.arange(65536, dtype=np.float32)
+        gray = (values - minpx) * (255.0 / max(maxpx - minpx, 1))
+        gray = gray.clip(0, 255).astype(np.uint8).reshape(-1, 1)
+        if self.colorMap:
+            lut = cv2.applyColorMap(gray, cv2.COLORMAP_JET).reshape(-1, 3)
+        else:
+            lut = np.repeat(gray, 3, axis=1)
+
+        # colors of invalid measurements
+        lut[epc_math.FLAG_LOW_AMPLITUDE] = FLAG_COLORS[epc_math.LOW_AMPLITUDE]
+        lut[epc_math.FLAG_SATURATION] = FLAG_COLORS[epc_math.SATURATION]
+        lut[epc_math.FLAG_ADC_OVERFLOW] = FLAG_COLORS[epc_math.ADC_OVERFLOW]
+
+        if self.rgb:
+            lut = lut[:, ::-1]
+        self._lut = np.ascontiguousarray(lut)
+
+    def _allocate(self, shape):
+        """
+        Allocate the buffers for images of the given (rotated) shape.
+        """
+        height, width = shape
+        self._shape = shape
+        self._colors = np.empty((height, width, 3), dtype=np.uint8)
+        self._out = [np.empty((height * self.scale, width * self.scale, 3),
+                              dtype=np.uint8) for i in range(self.buffers)]
+
+    def render(self, img, flags=None):
+        """
+        Render an image.
+
+        Parameters
+        ----------
+        img : numpy array
+            The image, uint16 or float that is clipped to uint16.
+        flags : numpy array, optional
+            Flag codes of epc_math.flag_mask in the orientation of img, for
+            images without the flag values. The default is None.
+
+        Returns
+        -------
+        dimg : numpy array
+            The color image, valid until buffers more images are rendered.
+
+        """
+        if img.dtype != np.uint16:
+            if self._u16 is None or self._u16.shape != img.shape:
+                self._u16 = np.empty(img.shape, dtype=np.uint16)
+            np.clip(img, 0, 65535, out=self._u16, casting='unsafe')
+            img = self._u16
+
+        if self.autoScale:
+            # the flag values are above all valid values
+            valid = img < epc_math.FLAG_LOW_AMPLITUDE - 100
+            if flags is not None:
+                valid &= flags == epc_math.VALID
+            # without any valid pixel the last range is kept
+            if valid.any():
+                minpx = int(np.min(img, where=valid, initial=65535))
+                maxpx = int(np.max(img, where=valid, initial=0)) + 1
+                lo, hi = self._range
+                margin = max(int((hi - lo) * self.RANGE_MARGIN), 16)
+                if abs(minpx - lo) > margin or abs(maxpx - hi) > margin:
+                    self._set_range(minpx, maxpx)
+
+        # Rotate image, as view
+        if self.rotate:
+            img = np.rot90(img)
+        if self._shape != img.shape:
+            self._allocate(img.shape)
+
+        np.take(self._lut, img, axis=0, out=self._colors)
+
+        if flags is not None and flags.any():
+            if self.rotate:
+                flags = np.rot90(flags)
+            invalid = flags.astype(bool)
+            colors = FLAG_COLORS[:, ::-1] if self.rgb else FLAG_COLORS
+            self._colors[invalid] = colors[flags[invalid]]
+
+        # Upscale image to make it visible on high res screens
+        out = self._out[self._index]
+        self._index = (self._index + 1) % self.buffers
+        if self.scale == 1:
+            out[:] = self._colors
+        else:
+            cv2.resize(self._colors, (out.shape[1], out.shape[0]), dst=out,
+                       interpolation=cv2.INTER_NEAREST)
+        return out
+
+
+# renderers of scale_image_rgb by their options
+_renderers = {}
+
+
+def scale_image_rgb(img, autoScale=True, colorMap=True, flags=None):
     """
     Converts the given distance image into an RGB-image and rescales
-    the image for better visibility
+    the image for better visibility, see DisplayRenderer.
 
     Parameters
     ----------
@@ -24,54 +202,22 @@ def scale_image_rgb(img, autoScale=True, colorMap=True):
         Rescale the value range to fit uint8. The default is True.
     colorMap : bool, optional
         Use a colormap instead of a gray scale. The default is True.
+    flags : numpy array, optional
+        The flag codes of the image from epc_math.flag_mask, for images
+        without the flag values. The default is None.
 
     Returns
     -------
     dimg : numpy array
-        The converted and rescaled image.
+        The converted and rescaled image, overwritten by the next calls.
 
     """
-	# Rotate image
-    dimg = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
-	
-	# Determine pixel masks for invalid measurements
-    low_amplitude = np.where(dimg == 65300)
-    saturation = np.where(dimg == 65400)
-    adc_overflow = np.where(dimg == 65500)
-	
-    if autoScale:
-        # Set pixels to invalid to make sure values do not screw with min/max calculations
-        g = dimg.astype(np.float)
-        g[low_amplitude] = np.NaN
-        g[saturation] = np.NaN
-        g[adc_overflow] = np.NaN
-		
-		# Scale uint16 values to range of values actually in the image
-        minpx = np.nanmin(dimg)
-        maxpx = np.nanmax(dimg)
-        g = (255.0 * (dimg - minpx)) / (maxpx - minpx)
-	
-    dimg = dimg.astype(np.uint8)
-	
-	# Convert grayscale image to color image
-    dimg = cv2.cvtColor(dimg, cv2.COLOR_GRAY2RGB)
-	
-	# Instead of grayscale image use colormap to color image
-    if colorMap:
-        g = cv2.applyColorMap(dimg, cv2.COLORMAP_JET)
-	
-	# Apply pixel masks by coloring invalid measurements
-    dimg[low_amplitude] = [255, 0, 0] # Blue
-    dimg[saturation] = [0, 255, 0] # Green
-    dimg[adc_overflow] = [0, 0, 255] # Red
-
-	# Upscale image to make it visible on high res screens
-    scale = 4.0
-    width = int(dimg.shape[1] * scale)
-    height = int(dimg.shape[0] * scale)
-    dimg = cv2.resize(dimg, (width, height), interpolation = cv2.INTER_CUBIC)
-
-    return dimg
+    key = (autoScale, colorMap)
+    renderer = _renderers.get(key)
+    if renderer is None:
+        renderer = DisplayRenderer(4, autoScale, colorMap)
+        _renderers[key] = renderer
+    return renderer.render(img, flags)
 
 
 def scale_image_gray(img):
@@ -130,7 +276,7 @@ def calc_image_cog(img, background, auto_thresh, threshold=None):
         thresh = threshold
 
     # segmentation of image into foreground and background
-    img_bin = (img < background - thresh).astype(np.uint8)
+    img_bin = epc_backend.get_backend()['threshold'](img, background, thresh)
 
     # get moments and calculated the center of gravity
     moments = cv2.moments(img_bin)
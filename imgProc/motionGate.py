@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Gate that lets the detection idle while the scene is empty. The decision is
+taken on a strided grid of the distance image, the full image is only
+processed while something is in front of the background.
+"""
+
+
+class MotionGate:
+    """
+    Decides per frame if the heavy processing is needed. After the last
+    frame with an object the processing continues for hold_frames frames,
+    so tracks can end and be counted.
+    """
+
+    def __init__(self, step=4, min_pixels=2, hold_frames=10, enabled=True):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        step : int, optional
+            Only every step-th row and column is compared with the
+            background. The default is 4.
+        min_pixels : int, optional
+            Number of grid pixels in front of the background that count as
+            motion. The default is 2.
+        hold_frames : int, optional
+            Number of frames processed after the last motion. The default
+            is 10.
+        enabled : bool, optional
+            With False every frame is processed. The default is True.
+
+        Returns
+        -------
+        None.
+
+        """
+        self.step = step
+        self.min_pixels = min_pixels
+        self.hold_frames = hold_frames
+        self.enabled = enabled
+
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        # the first frames are always processed
+        self._hold = hold_frames
+
+    def update(self, n_pixels, active=False):
+        """
+        Decide if the frame is processed.
+
+        Parameters
+        ----------
+        n_pixels : int
+            Number of grid pixels in front of the background.
+        active : bool, optional
+            There are ongoing tracks. The default is False.
+
+        Returns
+        -------
+        process : bool
+            True if the frame needs the full processing.
+
+        """
+        if not self.enabled or active or n_pixels >= self.min_pixels:
+            self._hold = self.hold_frames
+        elif self._hold > 0:
+            self._hold -= 1
+        else:
+            self.frames_skipped += 1
+            return False
+        self.frames_processed += 1
+        return True
+
+    def reset(self):
+        """
+        Process the next frames, e.g. after the background changed.
+        """
+        self._hold = self.hold_frames
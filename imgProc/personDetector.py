@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+"""
+Person detection on the distance images of one camera, independent of the
+GUI. Used by the live view of TOF_Imager and by the multi camera counter.
+"""
+
+from collections import deque
+
+import cv2
+import numpy as np
+
+from epc_lib import epc_backend, epc_math
+from imgProc import imgProcScale
+from imgProc.backgroundModel import Background, BackgroundModel
+from imgProc.denoise import Denoiser
+from imgProc.motionGate import MotionGate
+from imgProc.personTracker import PersonTracker
+
+
+# flag code of the pixels outside of the ROI mask, after those of
+# epc_math.flag_mask
+OUTSIDE_ROI = 4
+
+# amplitude of invalid pixels by flag code: low amplitude is dark, saturation
+# and ADC overflow are brighter than everything else
+FLAG_AMPLITUDES = np.array([0, 0, 65535, 65535, 0], dtype=np.float32)
+
+
+def roi_from_config(config):
+    """
+    Get the processing ROI from the configuration. The key roi is 'full',
+    'object_position' for the columns between min_object_position and
+    max_object_position plus roi_margin, or 'left,top,right,bottom'.
+
+    Parameters
+    ----------
+    config : dict
+        The configuration of the camera, see config.ini.
+
+    Returns
+    -------
+    roi : tuple
+        (left, top, right, bottom) in pixel, right and bottom exclusive.
+
+    """
+    width, height = config['img_width'], config['img_height']
+    roi = config.get('roi', 'full')
+    if roi == 'full':
+        return 0, 0, width, height
+    if roi == 'object_position':
+        margin = config.get('roi_margin', 10)
+        return (max(config['min_object_position'] - margin, 0), 0,
+                min(config['max_object_position'] + margin, width), height)
+    left, top, right, bottom = [int(value) for value in roi.split(',')]
+    return left, top, right, bottom
+
+
+class PersonDetector:
+    """
+    Keeps the state of the detection of one camera: background, image
+    buffer for the direction estimation and the position of the last
+    person.
+    """
+
+    def __init__(self, config):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        config : dict
+            The configuration of the camera, see config.ini.
+
+        Returns
+        -------
+        None.
+
+        """
+        # everything after the decode only sees the ROI, with roi_readout
+        # the camera sends only the ROI
+        self.roi = roi_from_config(config)
+        left, top, right, bottom = self.roi
+        self._crop = not config.get('roi_readout', 0)
+        self._outside = None
+        if 'roi_mask' in config:
+            mask = np.load(config['roi_mask']).astype(bool)
+            self._outside = ~mask[top:bottom, left:right]
+        config = dict(config, img_width=right - left, img_height=bottom - top,
+                      min_object_position=config['min_object_position'] - left,
+                      max_object_position=config['max_object_position'] - left)
+
+        self._config = config
+        self._threshold = config['min_object_height']  # objects taller than 0.2m only
+
+        # flag for auto background
+        self.auto_background = False
+
+        # centers of gravity of the last images for direction estimation
+        self._cog_buffer = deque(maxlen=config['img_direction_buffer_length'])
+
+        # detection and tracking of all persons in the image
+        self.tracker = PersonTracker(config)
+
+        # skip the detection while the scene is empty
+        self.gate = MotionGate(enabled=bool(config.get('motion_gate', 1)))
+
+        # create a zero background image
+        height, width = config['img_height'], config['img_width']
+        self._background = Background(np.zeros((height, width), np.float32),
+                                      self._threshold)
+
+        # the automatic background, updated with every frame
+        self._background_model = BackgroundModel(
+            height, width, config['img_avg_buffer_length'],
+            config.get('background_model', 'mean'))
+        self._auto = Background(self._background_model.background,
+                                self._threshold)
+
+        # flag codes of the last image, see epc_math.flag_mask
+        self.flags = np.zeros((height, width), dtype=np.uint8)
+
+        # reused buffers for distance, phase and amplitude
+        self._dpa_buffer = np.empty((3, height, width), dtype=np.float32)
+        self._denoised = np.empty((height, width), dtype=np.float32)
+
+        # noise suppression of the distance image
+        self._denoiser = Denoiser(height, width,
+                                  config.get('denoise_filter', 'median'),
+                                  config.get('denoise_ksize', 7))
+
+        # the implementation of the image kernels, measured once at startup
+        backend = config.get('compute_backend', 'auto')
+        if backend != 'auto':
+            epc_backend.use_backend(backend)
+        elif not epc_backend.benchmark_results:
+            epc_backend.select_backend(height, width)
+        self._kernels = epc_backend.get_backend()
+
+    @property
+    def background(self):
+        """
+        The fixed background image, used if auto background is off.
+        """
+        return self._background.image
+
+    @background.setter
+    def background(self, image):
+        # the images of get_image are reused, the background keeps a copy
+        self._background.set(np.array(image, dtype=np.float32))
+        self.gate.reset()
+
+    def has_motion(self, dist):
+        """
+        Check on a strided grid of the distance image if something is in
+        front of the background and decide if the frame needs the
+        detection, see MotionGate. The invalid pixels are taken from the
+        flags found by get_image.
+
+        Parameters
+        ----------
+        dist : numpy array
+            The distance image of get_image.
+
+        Returns
+        -------
+        process : bool
+            True if the frame needs the detection.
+
+        """
+        if not self.gate.enabled:
+            return self.gate.update(0)
+
+        if self.auto_background:
+            background = self._auto
+            valid = self._background_model.count > 0
+        else:
+            background = self._background
+            # the zero image of the constructor is no background
+            valid = self._background.version > 0
+        if not valid:
+            # everything would be in front of the background
+            return self.gate.update(0, active=True)
+
+        step = self.gate.step
+        threshold_map = background.cached(
+            'gate', lambda image: background.threshold_map[::step, ::step])
+        moving = dist[::step, ::step] < threshold_map
+        moving &= self.flags[::step, ::step] == epc_math.VALID
+        return self.gate.update(int(moving.sum()), bool(self.tracker.tracks))
+
+    def get_image(self, dcs):
+        """
+        Calculate the distance, phase and amplitude image from the DCS.
+        Only the ROI is processed. Invalid pixels, flagged by the server or
+        outside of the ROI mask, get the distance of the background and
+        their flag codes are kept in flags.
+
+        Parameters
+        ----------
+        dcs : numpy array
+            The DCS images.
+
+        Returns
+        -------
+        dist : numpy array
+            The distance image, overwritten by the next call.
+        phase : numpy array
+            The phase image, overwritten by the next call.
+        ampl : numpy array
+            The amplitude image, overwritten by the next call.
+
+        """
+        if self._crop:
+            left, top, right, bottom = self.roi
+            dcs = dcs[left:right, top:bottom]
+
+        # calculate the distance, phase and amplitude in one pass
+        dist, phase, ampl = self._kernels['dist_phase_ampl'](
+            dcs, self._config['mod_frequ'], out=self._dpa_buffer)
+        # correction of the distance error by table lookup of the phase
+        lut, _ = epc_math.distance_lut(self._config['mod_frequ'],
+                                       self._config['error_polynom'],
+                                       self._config['dist_offset'])
+        self._kernels['correction'](phase, lut, out=dist)
+
+        # find the invalid pixels once, the later stages use the flags
+        self.flags = epc_math.flag_mask(dcs).T
+        if self._outside is not None:
+            np.copyto(self.flags, OUTSIDE_ROI, where=self._outside)
+        invalid = None
+        if self.flags.any():
+            invalid = self.flags.astype(bool)
+            background = self._background.image
+            if self.auto_background and self._background_model.count:
+                background = self._auto.image
+            # the background never forms an object or moves the average
+            np.copyto(dist, background, where=invalid, casting='unsafe')
+            ampl[invalid] = 0
+
+        # do some noise suppresion
+        dist = self._denoiser.apply(dist, ampl, out=self._denoised)
+
+        if invalid is not None:
+            ampl[invalid] = FLAG_AMPLITUDES[self.flags[invalid]]
+
+        return dist, phase, ampl
+
+    def seed_background(self, dist):
+        """
+        Put the first image into the background model, also while auto
+        background is off, so the automatic background is valid as soon as
+        it is switched on.
+
+        Parameters
+        ----------
+        dist : numpy array
+            The distance image.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._background_model.update(dist)
+        self._auto.touch()
+
+    def update_background(self, dist):
+        """
+        Put the image into the background model, if auto background is on.
+
+        Parameters
+        ----------
+        dist : numpy array
+            The distance image.
+
+        Returns
+        -------
+        img_avg : Background
+            The current background, updated in place by the next call.
+
+        """
+        if not self.auto_background:
+            return self._background
+
+        self._background_model.update(dist)
+        self._auto.touch()
+        return self._auto
+
+    def get_height(self, image, background):
+        """
+        Calculate the height of the object in the distance image.
+
+        Parameters
+        ----------
+        image : numpy array
+            The distance image.
+        background : Background
+            The background.
+
+        Returns
+        -------
+        height : float
+            The calculated height of the object.
+        pos_correct: bool
+            Check if height is within the correct position
+        pos : numpy array
+            Position of the person
+
+        """
+        height = 0
+
+        base_height = background.base_height
+
+        # thresholding first
+        image[image > background.threshold_map] = base_height
+
+        # shift and flip
+        image = -1*(image - base_height)
+
+        # some gaussian blurring
+        img_blur = cv2.GaussianBlur(image, (15,5), 7)
+
+        # get the height
+        height = np.max(img_blur)
+        height = round(height, 2)
+
+        # get x-position of height
+        tmp_pos = np.argmax(img_blur)
+        pos = np.unravel_index(tmp_pos, img_blur.shape)
+        pos_correct = False
+        # check correct position for correct height calculation
+        min_pos = self._config['min_object_position']
+        max_pos = self._config['max_object_position']
+        if (min_pos < pos[1] < max_pos):
+            pos_correct = True
+        return height, pos_correct, pos
+
+    def fill_direction_buffer(self, image, background=None):
+        """
+        Put the center of gravity of an image into the buffer for the
+        direction estimation.
+
+        Parameters
+        ----------
+        image : numpy array
+            The distance image.
+        background : Background, optional
+            The background. The default is None, then the current one is
+            used.
+
+        Returns
+        -------
+        None.
+
+        """
+        if background is None:
+            background = self._auto if self.auto_background else self._background
+        self._cog_buffer.append(imgProcScale.calc_image_cog(
+            image, background.image, False, self._threshold))
+
+    def get_direction(self, image, background):
+        """
+        Calculate the direction of the moving object in the given image.
+
+        Parameters
+        ----------
+        image : numpy array
+            The current image.
+        background: Background
+            The background.
+
+        Returns
+        -------
+        direction : int
+            Direction indicator: left      -> 0,
+                                 right     -> +1.
+                                 undefined -> -1
+
+        """
+        direction = -1
+        # calculate cog of new image, the one of the 5th last image was
+        # calculated when it arrived
+        cog_new = imgProcScale.calc_image_cog(image, background.image,
+                                              False, self._threshold)
+
+        if self._cog_buffer:
+            cog = self._cog_buffer[0] - cog_new
+            if cog[0] > 0:
+                direction = 0
+            elif cog[0] < 0:
+                direction = 1
+
+        # append the current cog to the buffer, the oldest one drops out
+        self._cog_buffer.append(cog_new)
+
+        return direction
+
+    def track_persons(self, image, background):
+        """
+        Track all persons in the scene and return the new ones. A person is
+        new when its track gets taller than the minimal person height for
+        the first time.
+
+        Parameters
+        ----------
+        image : numpy array
+            The distance image.
+        background : Background
+            The background.
+
+        Returns
+        -------
+        directions : list of int
+            Direction of every new person: down -> 0, up -> 1.
+
+        """
+        return self.tracker.update(image, background)
+
+    def process(self, dcs):
+        """
+        Run the whole detection on the given DCS images.
+
+        Parameters
+        ----------
+        dcs : numpy array
+            The DCS images.
+
+        Returns
+        -------
+        dist : numpy array
+            The distance image.
+        ampl : numpy array
+            The amplitude image.
+        height : float
+            The calculated height of the object.
+        pos_correct : bool
+            Check if height is within the correct position.
+        directions : list of int
+            Direction of every new person, see track_persons.
+
+        Without motion, see has_motion, height is 0 and there are no
+        directions.
+
+        """
+        dist, phase, ampl = self.get_image(dcs)
+        motion = self.has_motion(dist)
+        # the background also follows the empty scene
+        img_avg = self.update_background(dist)
+        if not motion:
+            return dist, ampl, 0, False, []
+
+        height, pos_correct, pos = self.get_height(dist.copy(), img_avg)
+        directions = self.track_persons(dist, img_avg)
+        return dist, ampl, height, pos_correct, directions
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Detection and tracking of several persons in the distance images. The
+foreground is segmented into connected blobs in one pass, the blobs are
+assigned to the tracks of the last frame by their nearest centroid.
+"""
+
+import cv2
+import numpy as np
+
+
+class Track:
+    """
+    A person followed over several frames.
+    """
+
+    def __init__(self, track_id, centroid, height, area):
+        self.id = track_id
+        self.centroid = centroid
+        self.entry = centroid
+        self.height = height
+        self.max_height = height
+        self.area = area
+        self.missed = 0
+        self.counted = False
+
+
+class PersonTracker:
+    """
+    Finds the blobs closer than the background by more than the threshold
+    and tracks them. A track is counted as new person once it is taller
+    than min_person_height; the direction follows from the half of the
+    image where it entered.
+    """
+
+    def __init__(self, config, min_area=30, max_distance=30, max_missed=3,
+                 max_blobs=16):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        config : dict
+            The configuration of the camera, see config.ini.
+        min_area : int, optional
+            Smallest blob in pixel. The default is 30.
+        max_distance : float, optional
+            Largest movement of a centroid between two frames in pixel. The
+            default is 30.
+        max_missed : int, optional
+            Number of frames a track survives without blob. The default is
+            3.
+        max_blobs : int, optional
+            Only the largest blobs are tracked, so the cost per frame stays
+            bounded. The default is 16.
+
+        Returns
+        -------
+        None.
+
+        """
+        self._min_height = config['min_object_height']
+        self._min_person_height = config['min_person_height']
+        self._img_height = config['img_height']
+        self.min_area = min_area
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.max_blobs = max_blobs
+
+        self.tracks = []
+        self._next_id = 0
+        self._mask = np.empty((config['img_height'], config['img_width']),
+                              dtype=np.uint8)
+
+    def detect(self, image, background):
+        """
+        Find the blobs in the distance image.
+
+        Parameters
+        ----------
+        image : numpy array
+            The distance image.
+        background : Background
+            The background.
+
+        Returns
+        -------
+        centroids : numpy array, shape (n, 2)
+            The centroids (row, column) of the blobs.
+        heights : numpy array, shape (n,)
+            The height of the highest point of every blob.
+        areas : numpy array, shape (n,)
+            The area of every blob in pixel.
+
+        """
+        np.less(image, background.threshold_map, out=self._mask.view(bool))
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            self._mask, connectivity=8)
+
+        # label 0 is the background
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        keep = np.flatnonzero(areas >= self.min_area)
+        if keep.size > self.max_blobs:
+            keep = keep[np.argsort(areas[keep])[::-1][:self.max_blobs]]
+        if keep.size == 0:
+            return np.empty((0, 2)), np.empty(0), np.empty(0, dtype=int)
+
+        # height of every blob in one pass over the foreground pixels
+        foreground = labels > 0
+        heights = np.zeros(n, dtype=np.float32)
+        np.maximum.at(heights, labels[foreground],
+                      background.base_height - image[foreground])
+
+        blobs = keep + 1
+        return centroids[blobs, ::-1], heights[blobs], areas[keep]
+
+    def update(self, image, background):
+        """
+        Detect the blobs and assign them to the tracks.
+
+        Parameters
+        ----------
+        image : numpy array
+            The distance image.
+        background : Background
+            The background.
+
+        Returns
+        -------
+        directions : list of int
+            Direction of every new person in this frame: down -> 0, up -> 1.
+
+        """
+        centroids, heights, areas = self.detect(image, background)
+        tall = heights > self._min_height
+        centroids, heights, areas = centroids[tall], heights[tall], areas[tall]
+
+        # nearest neighbour assignment, closest pairs first
+        assigned = np.zeros(len(centroids), dtype=bool)
+        if self.tracks and len(centroids):
+            previous = np.array([track.centroid for track in self.tracks])
+            distance = np.linalg.norm(previous[:, None] - centroids[None],
+                                      axis=2)
+            matched = np.zeros(len(self.tracks), dtype=bool)
+            for index in np.argsort(distance, axis=None):
+                t, b = divmod(index, len(centroids))
+                if distance[t, b] > self.max_distance:
+                    break
+                if matched[t] or assigned[b]:
+                    continue
+                matched[t] = assigned[b] = True
+                track = self.tracks[t]
+                track.centroid = centroids[b]
+                track.height = heights[b]
+                track.max_height = max(track.max_height, heights[b])
+                track.area = areas[b]
+                track.missed = -1
+        for track in self.tracks:
+            track.missed += 1
+        self.tracks = [track for track in self.tracks
+                       if track.missed <= self.max_missed]
+
+        for b in np.flatnonzero(~assigned):
+            self.tracks.append(Track(self._next_id, centroids[b], heights[b],
+                                     areas[b]))
+            self._next_id += 1
+
+        # count every track once, when it is tall enough for a person
+        directions = []
+        for track in self.tracks:
+            if not track.counted and track.max_height > self._min_person_height:
+                track.counted = True
+                # person enters in the upper or lower half, assuming it
+                # keeps direction
+                directions.append(int(track.entry[0] < self._img_height / 2))
+        return directions
@@ -1,58 +1,10 @@
 import cv2
 import numpy as np
-from epc_lib import epc_server, epc_image
+from epc_lib import epc_server, epc_image, epc_math
+from imgProc.imgProcScale import DisplayRenderer
 import h5py
 
 
-def displayImage(img, autoScale=True, colorMap=True):
-	# Rotate image
-	dimg = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
-
-	# Determine pixel masks for invalid measurements
-	low_amplitude = np.where(dimg == 65300)
-	saturation = np.where(dimg == 65400)
-	adc_overflow = np.where(dimg == 65500)
-
-	if autoScale:
-		# Set pixels to invalid to make sure values do not screw with min/max calculations
-		dimg = dimg.astype(np.float)
-		dimg[low_amplitude] = np.NaN
-		dimg[saturation] = np.NaN
-		dimg[adc_overflow] = np.NaN
-
-		# Scale uint16 values to range of values actually in the image
-		minpx = np.nanmin(dimg)
-		maxpx = np.nanmax(dimg)
-		dimg = (255.0 * (dimg - minpx)) / (maxpx - minpx)
-		dimg = dimg.astype(np.uint8)
-
-	else:
-		# dimg type is 16bits, but only 12 bits are used
-		# we extract only the upper 8 bits
-		dimg = (dimg >> 4).astype(np.uint8)
-
-	# Convert grayscale image to color image
-	dimg = cv2.cvtColor(dimg, cv2.COLOR_GRAY2RGB)
-
-	# Instead of grayscale image use colormap to color image
-	if colorMap:
-		dimg = cv2.applyColorMap(dimg, cv2.COLORMAP_JET)
-
-	# Apply pixel masks by coloring invalid measurements
-	dimg[low_amplitude] = [255, 0, 0] # Blue
-	dimg[saturation] = [0, 255, 0] # Green
-	dimg[adc_overflow] = [0, 0, 255] # Red
-
-	# Upscale image to make it visible on high res screens
-	scale = 5.0
-	width = int(dimg.shape[1] * scale)
-	height = int(dimg.shape[0] * scale)
-	dimg = cv2.resize(dimg, (width, height), interpolation = cv2.INTER_CUBIC)
-
-	return dimg
-
-
-
 ### Main Objects
 server = epc_server('192.168.7.2') # USB connection
 #server  =  epc_server('192.168.1.80') # Ethernet connection
@@ -129,33 +81,45 @@ else:
 
 server.sendCommand('loadConfig 1')				  # loadConfig 1 = TOF mode (3D imaging)
 
-#server.sendCommand('startVideo')	 				# increases the fps, but only usable if you don't record the temperature, too
+# video mode is started by the stream, see epc_image.streamDCSs
 
 
 
 cv2.namedWindow('ESPROS ToF Cam')
 
+# the color tables of the display are built once, 5 times upscaled
+ampRenderer = DisplayRenderer(scale=5, autoScale=False, colorMap=False)
+distRenderer = DisplayRenderer(scale=5, autoScale=True, colorMap=True)
+dcsRenderer = DisplayRenderer(scale=5, autoScale=False, colorMap=False, buffers=4)
+
 enableSaveImages = False
 
+if mode == 'distamp':
+	stream = image_epcDev.streamDistAmpl()
+else:
+	stream = image_epcDev.streamDCSs()
+
 while True:
 	if mode == 'distamp':
-		imageData3D = image_epcDev.getDistAmpl()
+		imageData3D = next(stream)
 
 		ampImg  = imageData3D[:,:,1]
 		distImg = imageData3D[:,:,0]
+		flags = epc_math.flag_mask(imageData3D)
 
-		dispAmpImg = displayImage(ampImg, autoScale=False, colorMap=False)
-		dispDistImg = displayImage(distImg, autoScale=True, colorMap=True)
+		dispAmpImg = ampRenderer.render(ampImg, flags)
+		dispDistImg = distRenderer.render(distImg, flags)
 		dispImg = np.hstack((dispAmpImg, dispDistImg))
 
 		cv2.imshow('ESPROS ToF Cam', dispImg)
 
 	elif mode == 'dcs':
-		imageData3D = image_epcDev.getDCSs()
+		imageData3D = next(stream)
 		images = []
+		flags = epc_math.flag_mask(imageData3D)
 		for i in range(imageData3D.shape[2]):
 			dcs_i = imageData3D[:,:,i]
-			dispDCS_i = displayImage(dcs_i, autoScale=False, colorMap=False)
+			dispDCS_i = dcsRenderer.render(dcs_i, flags)
 			cv2.putText(dispDCS_i, f'DCS{i}', (20, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), lineType=cv2.LINE_AA)
 			images.append(dispDCS_i)
 
@@ -186,4 +150,5 @@ while True:
 			h5f.close()
 			print('Saving file done.')
 
+stream.close()
 cv2.destroyAllWindows()